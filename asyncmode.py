@@ -0,0 +1,190 @@
+import asyncio
+import functools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+import metrics
+import planning
+
+# Mode asyncio : Slack passe par le client aiohttp de Bolt, les appels Google (googleapiclient / gspread,
+# bloquants) par un pool de threads borné. Chaque thread du pool garde ses propres clients (ClientRegistry).
+ASYNC_IO_WORKERS = int(os.getenv("ASYNC_IO_WORKERS", "32"))  # Nombre max d'appels Google simultanés
+
+executor = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix="google-io")
+app = AsyncApp(token=planning.SLACK_BOT_TOKEN)
+app.middleware(metrics.async_slack_middleware)
+
+
+async def run_io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args))
+
+
+def calendar_call(fn, *args):
+    # Le service Calendar doit être obtenu dans le thread qui l'utilise
+    return fn(planning.clients.calendar(), *args)
+
+
+@app.command("/rdv")
+@metrics.listener("rdv")
+async def handle_rdv(ack, body, client):
+    await ack()
+    # Instantané récent : la réponse est déjà construite, aucun appel Google
+    snapshot = planning.fresh_snapshot()
+    if snapshot is not None:
+        if not snapshot.slots:
+            await client.chat_postMessage(channel=body["user_id"], text="Aucun créneau disponible.")
+        else:
+            await client.chat_postMessage(channel=body["user_id"], text="Voici les créneaux disponibles :",
+                                          blocks=snapshot.pages[0])
+        return
+
+    cursor_id, total = await run_io(calendar_call, planning.open_slot_cursor)
+
+    if not total:
+        await client.chat_postMessage(channel=body["user_id"], text="Aucun créneau disponible.")
+        return
+
+    await client.chat_postMessage(channel=body["user_id"], text="Voici les créneaux disponibles :",
+                                  blocks=planning.slot_page_blocks(cursor_id, 0))
+
+
+@app.action(re.compile(r"^rdv_page_(prev|next)$"))
+@metrics.listener("rdv_page")
+async def handle_rdv_page(ack, body, client):
+    await ack()
+    # Page lue dans le curseur en mémoire : aucun appel Google
+    cursor_id, page = planning.parse_page_value(body["actions"][0]["value"])
+    blocks = planning.slot_page_blocks(cursor_id, page)
+    if blocks is None:
+        await client.chat_update(channel=body["channel"]["id"], ts=body["message"]["ts"],
+                                 text="⌛ Cette liste a expiré, relance /rdv.", blocks=[])
+        return
+    await client.chat_update(channel=body["channel"]["id"], ts=body["message"]["ts"],
+                             text="Voici les créneaux disponibles :", blocks=blocks)
+
+
+@app.action("book_slot")
+@metrics.listener("book_slot")
+async def handle_booking(ack, body, client):
+    await ack()
+    user = body["user"]["username"]
+    row_idx, date_str, time_str, duration, start, end = planning.parse_slot_value(body["actions"][0]["value"])
+
+    if not await run_io(calendar_call, planning.is_slot_free, start, end):
+        await client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà réservé.")
+        return
+
+    if await run_io(calendar_call, planning.book_event, f"RDV avec {user}", start, end, user,
+                    body["user"]["id"]) is None:
+        await client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà réservé.")
+        return
+
+    # La Sheet et la confirmation Slack sont indépendantes : envoyées en parallèle
+    await asyncio.gather(
+        run_io(planning.mark_slot_booked, row_idx),
+        client.chat_postMessage(channel=body["user"]["id"],
+                                text=f"✅ Rendez-vous confirmé : {date_str} à {time_str} pour {duration} min."),
+    )
+
+
+@app.view("rdv_submit")
+@metrics.listener("rdv_submit")
+async def handle_submission(ack, body, view, client):
+    await ack()
+    user = body["user"]["username"]
+    start_hour, duration_min, subject, start_dt, end_dt = planning.parse_rdv_submission(view["state"]["values"])
+
+    if not await run_io(calendar_call, planning.is_slot_free, start_dt, end_dt):
+        await client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà occupé.")
+        return
+
+    if await run_io(calendar_call, planning.book_event, f"{subject} - {user}", start_dt, end_dt,
+                    user, body["user"]["id"]) is None:
+        await client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà occupé.")
+        return
+
+    await asyncio.gather(
+        run_io(planning.append_booking_row, start_dt.date(), start_hour, duration_min, subject, user),
+        client.chat_postMessage(channel=body["user"]["id"],
+                                text=f"✅ RDV confirmé le {start_dt.strftime('%d/%m')} à {start_hour} pour {duration_min} min."),
+    )
+
+
+@app.action("book_meeting")
+@metrics.listener("book_meeting")
+async def handle_meeting(ack, body, respond):
+    await ack()
+    user = body["user"]["username"]
+    start, end = planning.parse_meeting_value(body["actions"][0]["value"])
+    booked = await run_io(lambda: planning.book_event(planning.get_calendar_service(),
+                                                      f"Rendez-vous avec {user}", start, end, user,
+                                                      body["user"]["id"]))
+    if booked is None:
+        await respond("❌ Ce créneau est déjà réservé.")
+        return
+    await respond(f"✅ Rendez-vous réservé : {start.strftime('%H:%M')} → {end.strftime('%H:%M')}")
+
+
+@app.command("/rdv-serie")
+@metrics.listener("rdv_serie")
+async def handle_bulk_booking(ack, body, client):
+    await ack()
+    text = await run_io(planning.bulk_reply, body["user_name"], body.get("text", ""), body["user_id"])
+    await client.chat_postMessage(channel=body["user_id"], text=text)
+
+
+@app.command("/creneau-commun")
+@metrics.listener("creneau_commun")
+async def handle_common_slot(ack, body, client):
+    await ack()
+    text = await run_io(planning.common_slot_reply, body["user_id"], body.get("text", ""))
+    await client.chat_postMessage(channel=body["user_id"], text=text)
+
+
+@app.command("/dispos")
+@metrics.listener("dispos")
+async def open_availability_modal(ack, body, client):
+    await ack()
+    await client.views_open(trigger_id=body["trigger_id"], view=planning.availability_modal_view())
+
+
+@app.options(re.compile(r"^(start|end)_time_input$"))
+@metrics.listener("slot_options")
+async def handle_slot_options(ack, body):
+    # Lecture mémoire de l'index ; seul un index absent (précalcul arrêté) déclenche un appel Google
+    options = await run_io(planning.slot_options, body["view"]["callback_id"], body.get("value", ""))
+    await ack(options=options)
+
+
+@app.view("update_availability")
+@metrics.listener("update_availability")
+async def handle_availability(ack, view, client, body):
+    await ack()
+    text = await run_io(planning.save_availability, *planning.parse_availability_submission(view["state"]["values"]))
+    await client.chat_postMessage(channel=body["user"]["id"], text=text)
+
+
+@app.command("/rdv-stats")
+@metrics.listener("rdv_stats")
+async def handle_stats(ack, body, client):
+    await ack()
+    text = await run_io(planning.stats_reply, body["user_name"])
+    await client.chat_postMessage(channel=body["user_id"], text=text)
+
+
+async def main():
+    handler = AsyncSocketModeHandler(app, planning.SLACK_APP_TOKEN)
+    await handler.connect_async()
+    planning.startup_report("Connecté à Slack, prêt")
+    if planning.WARM_UP:
+        executor.submit(planning.warm_up)
+    planning.start_background_jobs()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
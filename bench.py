@@ -0,0 +1,468 @@
+import argparse
+import bisect
+import datetime
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Banc d'essai hors ligne : Calendar, Sheets et Slack sont remplacés par des doublures locales
+# qui comptent les appels et simulent une latence réseau configurable.
+
+TIMEZONE_OFFSET = "+01:00"
+
+
+class CallLog:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+class _Request:
+    def __init__(self, log, name, fn):
+        self.log = log
+        self.name = name
+        self.fn = fn
+
+    def execute(self, **kwargs):
+        self.log.record(self.name)
+        return self.fn()
+
+
+class FakeEvents:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def insert(self, calendarId, body):
+        return _Request(self.calendar.log, "calendar.events.insert", lambda: self.calendar.add(body))
+
+    def get(self, calendarId, eventId):
+        return _Request(self.calendar.log, "calendar.events.get", lambda: self.calendar.events[eventId])
+
+    def update(self, calendarId, eventId, body):
+        return _Request(self.calendar.log, "calendar.events.update", lambda: self.calendar.add(body))
+
+    def list(self, calendarId, **params):
+        return _Request(self.calendar.log, "calendar.events.list",
+                        lambda: {"items": list(self.calendar.events.values()), "nextSyncToken": "bench"})
+
+
+class FakeBatch:
+    # BatchHttpRequest : un seul aller-retour, un rappel par requête
+    def __init__(self, log, callback):
+        self.log = log
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.log.record("calendar.batch")
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.fn(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeFreebusy:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def query(self, body):
+        return _Request(self.calendar.log, "calendar.freebusy.query", lambda: self.calendar.freebusy(body))
+
+
+class FakeCalendar:
+    # Agenda en mémoire : événements triés par début pour répondre aux requêtes freebusy
+
+    def __init__(self, log):
+        self.log = log
+        self.events = {}
+        self._starts = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def add(self, body):
+        from freebusy import parse_rfc3339, to_aware
+        with self._lock:
+            event_id = body.get("id") or f"bench{next(self._ids)}"
+            start = to_aware(parse_rfc3339(body["start"]["dateTime"]))
+            end = to_aware(parse_rfc3339(body["end"]["dateTime"]))
+            event = dict(body, id=event_id, status="confirmed",
+                         start={"dateTime": start.isoformat()}, end={"dateTime": end.isoformat()})
+            self.events[event_id] = event
+            bisect.insort(self._starts, (start, end))
+            return event
+
+    def freebusy(self, body):
+        from freebusy import parse_rfc3339
+        time_min, time_max = parse_rfc3339(body["timeMin"]), parse_rfc3339(body["timeMax"])
+        with self._lock:
+            idx = bisect.bisect_left(self._starts, (time_max,))
+            busy = [{"start": s.isoformat(), "end": e.isoformat()}
+                    for s, e in self._starts[:idx] if e > time_min]
+        return {"calendars": {item["id"]: {"busy": busy} for item in body["items"]}}
+
+    def service(self):
+        calendar = self
+
+        class Service:
+            def events(self):
+                return FakeEvents(calendar)
+
+            def freebusy(self):
+                return FakeFreebusy(calendar)
+
+            def new_batch_http_request(self, callback=None):
+                return FakeBatch(calendar.log, callback)
+        return Service()
+
+
+class FakeSpreadsheet:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeWorksheet:
+    # Feuille gspread en mémoire (valeurs brutes, ligne 1 = en-tête)
+
+    def __init__(self, log, name, values):
+        self.log = log
+        self.name = name
+        self.id = 0
+        self.spreadsheet = FakeSpreadsheet(name)
+        self.values = [list(row) for row in values]
+        self._lock = threading.Lock()
+
+    def _call(self, method):
+        self.log.record(f"sheets.{self.name}.{method}")
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        with self._lock:
+            return [list(row) for row in self.values]
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        with self._lock:
+            header = self.values[0]
+            return [dict(zip(header, row)) for row in self.values[1:]]
+
+    def col_values(self, col):
+        self._call("col_values")
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.values]
+
+    def _set(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        line = self.values[row - 1]
+        while len(line) < col:
+            line.append("")
+        line[col - 1] = value
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        with self._lock:
+            self._set(row, col, value)
+
+    def append_row(self, values):
+        self._call("append_row")
+        with self._lock:
+            self.values.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        with self._lock:
+            self.values.extend(list(row) for row in values)
+
+    def batch_update(self, data, **kwargs):
+        from gspread.utils import a1_to_rowcol
+        self._call("batch_update")
+        with self._lock:
+            for change in data:
+                first = change["range"].split(":")[0]
+                row, col = a1_to_rowcol(first)
+                for i, line in enumerate(change["values"]):
+                    for j, value in enumerate(line):
+                        self._set(row + i, col + j, value)
+
+
+class FakeRegistry:
+    # Remplace clients.ClientRegistry : mêmes accesseurs, doublures locales
+    def __init__(self, calendar, worksheets):
+        self._calendar = calendar
+        self._worksheets = worksheets
+
+    def credentials(self):
+        return None
+
+    def calendar(self):
+        return self._calendar.service()
+
+    def worksheet(self, key=None, title=None):
+        return self._worksheets["rules" if title else "slots"]
+
+
+class FakeSlackClient:
+    def __init__(self, log):
+        self.log = log
+
+    def chat_postMessage(self, **kwargs):
+        self.log.record("slack.chat_postMessage")
+        return {"ok": True, "ts": str(time.time()), "channel": kwargs.get("channel")}
+
+    def chat_update(self, **kwargs):
+        self.log.record("slack.chat_update")
+        return {"ok": True}
+
+    def views_open(self, **kwargs):
+        self.log.record("slack.views_open")
+        return {"ok": True}
+
+
+# -- Jeux de données synthétiques
+def slot_sheet_values(rows, start_date):
+    values = [["Date", "Heure", "Durée", "Disponible"]]
+    for n in range(rows):
+        day = start_date + datetime.timedelta(days=n // 18)
+        minutes = 8 * 60 + (n % 18) * 30
+        values.append([day.isoformat(), f"{minutes // 60:02d}:{minutes % 60:02d}", 30, "✅"])
+    return values
+
+
+def rules_sheet_values():
+    values = [["Jour", "Heure début", "Heure fin", "Durée créneau (min)", "Actif"]]
+    for day in ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]:
+        values.append([day, "09:00", "18:00", 30, "oui"])
+    return values
+
+
+def fill_calendar(calendar, events, start_date):
+    # Agenda dense : événements de 45 min répartis sur les jours ouvrés à venir
+    for n in range(events):
+        day = start_date + datetime.timedelta(days=n // 10)
+        minutes = 8 * 60 + 7 + (n % 10) * 55
+        start = datetime.datetime.combine(day, datetime.time(minutes // 60, minutes % 60))
+        end = start + datetime.timedelta(minutes=45)
+        calendar.add({"start": {"dateTime": start.isoformat() + TIMEZONE_OFFSET},
+                      "end": {"dateTime": end.isoformat() + TIMEZONE_OFFSET}})
+
+
+# -- Scénarios
+def noop(*args, **kwargs):
+    pass
+
+
+def user_body(n):
+    return {"user": {"id": f"U{n}", "username": f"user{n}"}, "user_id": f"U{n}", "trigger_id": f"T{n}"}
+
+
+def scenarios(planning, slack, available):
+    today = datetime.date.today()
+    counter = itertools.count()
+    days = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
+
+    def rdv(n):
+        planning.handle_rdv(ack=noop, body=user_body(n), client=slack)
+
+    def rdv_snapshot(n):
+        # Réponse servie par l'instantané précalculé (calculé une fois, comme le ferait le daemon)
+        if planning.precomputer.snapshot is None:
+            planning.precomputer.refresh()
+        planning.handle_rdv(ack=noop, body=user_body(n), client=slack)
+
+    cursor = []
+
+    def rdv_page(n):
+        # Le curseur est ouvert une fois (équivalent d'un /rdv), puis seules les pages sont rendues
+        if not cursor:
+            cursor.append(planning.open_slot_cursor(planning.clients.calendar())[0])
+        body = dict(user_body(n), actions=[{"value": f"{cursor[0]}|{n % 20}"}],
+                    channel={"id": f"D{n}"}, message={"ts": "1"})
+        planning.handle_rdv_page(ack=noop, body=body, client=slack)
+
+    def book_slot(n):
+        idx, row = available[next(counter) % len(available)]
+        body = dict(user_body(n), actions=[{"value": f"{idx}|{row['Date']}|{row['Heure']}|{row['Durée']}"}])
+        planning.handle_book_slot(ack=noop, body=body, client=slack)
+
+    def rdv_submit(n):
+        minutes = (next(counter) * 7) % (24 * 60)
+        values = {
+            "start_time_block": {"start_time_input": {"selected_option": {"value": f"{minutes // 60:02d}:{minutes % 60:02d}"}}},
+            "duration_block": {"duration_input": {"selected_option": {"value": "30"}}},
+            "subject_block": {"subject_input": {"value": "bench"}},
+        }
+        planning.handle_rdv_submit(ack=noop, body=user_body(n), view={"state": {"values": values}},
+                                   logger=None, client=slack)
+
+    def update_availability(n):
+        values = {
+            "day_block": {"day": {"selected_option": {"value": days[n % len(days)]}}},
+            "start_time_block": {"start_time_input": {"selected_option": {"value": "09:00"}}},
+            "end_time_block": {"end_time_input": {"selected_option": {"value": "17:00"}}},
+            "duration_block": {"duration": {"value": "30"}},
+            "active_block": {"active": {"selected_option": {"value": "oui"}}},
+        }
+        planning.handle_availability_submission(ack=noop, body=user_body(n), view={"state": {"values": values}},
+                                                respond=noop)
+
+    def rdv_serie(n):
+        # Série hebdomadaire de 20 rendez-vous : une lecture freebusy, un batch d'insertions, une écriture Sheet
+        minutes = 8 * 60 + (next(counter) * 35) % (10 * 60)
+        day = today + datetime.timedelta(days=1 + n % 7)
+        text = f"{day.isoformat()} {minutes // 60:02d}:{minutes % 60:02d} 30 FREQ=WEEKLY;COUNT=20 bench"
+        planning.bulk_reply(f"user{n}", text)
+
+    def slot_options(n):
+        # Frappe dans la liste déroulante du modal rdv_submit : recherche par préfixe dans l'index en mémoire
+        queries = ["", "lun", "mardi 1", "14", "10:30", today.strftime("%d/%m")]
+        body = {"view": {"callback_id": "rdv_submit"}, "action_id": "start_time_input", "value": queries[n % len(queries)]}
+        planning.handle_slot_options(ack=noop, body=body)
+
+    def creneau_commun(n):
+        # Même recherche répétée : seule la première commande interroge freebusy, les suivantes lisent l'index
+        planning.common_slot_reply(f"U{n}", "default 30")
+
+    def rdv_stats(n):
+        # Compteurs du journal : seules les réservations faites depuis la lecture précédente sont relues
+        planning.handle_stats(ack=noop, body=dict(user_body(n), user_name=f"user{n}"), client=slack)
+
+    def slots_for_day(n):
+        planning.get_slots_for_day(days[n % len(days)])
+
+    return {
+        "rdv": rdv,
+        "rdv_snapshot": rdv_snapshot,
+        "rdv_page": rdv_page,
+        "book_slot": book_slot,
+        "rdv_submit": rdv_submit,
+        "update_availability": update_availability,
+        "rdv_serie": rdv_serie,
+        "creneau_commun": creneau_commun,
+        "slot_options": slot_options,
+        "rdv_stats": rdv_stats,
+        "get_slots_for_day": slots_for_day,
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_scenario(fn, ops, users, log):
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def one(n):
+        t = time.perf_counter()
+        try:
+            fn(n)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] += 1
+        with lock:
+            latencies.append(time.perf_counter() - t)
+
+    log.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(one, range(ops)))
+    elapsed = time.perf_counter() - started
+    return {
+        "ops": ops,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "throughput": ops / elapsed if elapsed else 0.0,
+        "api_calls_per_op": log.total() / ops if ops else 0.0,
+        "calls": dict(log.calls),
+        "errors": dict(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne du bot de planning")
+    parser.add_argument("--scenario", action="append", help="Scénario à lancer (plusieurs possibles, tous par défaut)")
+    parser.add_argument("--ops", type=int, default=200, help="Nombre de commandes par scénario")
+    parser.add_argument("--users", type=int, default=8, help="Utilisateurs simultanés")
+    parser.add_argument("--rows", type=int, default=1000, help="Lignes de la Sheet des créneaux")
+    parser.add_argument("--events", type=int, default=2000, help="Événements déjà présents dans l'agenda")
+    parser.add_argument("--latency", type=float, default=5.0, help="Latence simulée par appel API (ms)")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "sheet"], help="Backend des créneaux")
+    parser.add_argument("--json", action="store_true", help="Sortie JSON (suivi des régressions)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="planning-bench-")
+    os.environ.update({
+        "SLACK_BOT_TOKEN": os.getenv("SLACK_BOT_TOKEN", "xoxb-bench"),
+        "DB_PATH": os.path.join(workdir, "bench.db"),
+        "BOOKING_LOG": os.path.join(workdir, "bookings.jsonl"),
+        "STORE_BACKEND": args.backend,
+        "CALENDAR_SYNC_INTERVAL": "0",
+        "SHEET_WRITE_WINDOW": "0.005",
+        "CALENDAR_ID": "bench@calendar",
+        "JOB_WORKERS": "0",  # Travaux exécutés dans le thread du listener : latence de bout en bout
+        "CALENDAR_RATE": "100000",  # Pas de limitation de débit : on mesure le code, pas les quotas Google
+        "SHEETS_RATE": "100000",
+    })
+    import planning
+
+    log = CallLog(latency=args.latency / 1000)
+    start_date = datetime.date.today() + datetime.timedelta(days=1)
+    calendar = FakeCalendar(log)
+    fill_calendar(calendar, args.events, start_date)
+    worksheets = {
+        "slots": FakeWorksheet(log, "slots", slot_sheet_values(args.rows, start_date)),
+        "rules": FakeWorksheet(log, "rules", rules_sheet_values()),
+    }
+    planning.clients = planning.user_clients = FakeRegistry(calendar, worksheets)
+    slack = FakeSlackClient(log)
+
+    available = planning.store.available_rows()
+    selected = args.scenario or list(scenarios(planning, slack, available))
+    results = {}
+    for name in selected:
+        planning.cache.clear()
+        results[name] = run_scenario(scenarios(planning, slack, available)[name], args.ops, args.users, log)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    print(f"{'scénario':<22}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'API/op':>10}  erreurs")
+    for name, r in results.items():
+        print(f"{name:<22}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['throughput']:>10.1f}"
+              f"{r['api_calls_per_op']:>10.2f}  {r['errors'] or '-'}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
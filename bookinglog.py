@@ -0,0 +1,201 @@
+import argparse
+import collections
+import contextlib
+import csv
+import datetime
+import json
+import os
+import sys
+import threading
+
+# Journal local des réservations : un objet JSON par ligne, fichier en ajout seul ; une annulation est une ligne
+# de plus (status "cancelled", mêmes date / heure / durée / utilisateur) qui retire la réservation des compteurs. Les compteurs (par utilisateur,
+# par jour / heure, minutes réservées) sont tenus à jour au fil des lignes lues et sauvegardés à côté du journal
+# avec la position atteinte : au redémarrage seules les lignes nouvelles sont relues.
+
+FIELDS = ["id", "booked_at", "date", "start", "duration", "subject", "user", "status"]
+DAY_NAMES = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+EXPORT_BATCH = 10000  # Lignes par groupe Parquet (mémoire constante quelle que soit la taille du journal)
+
+
+class BookingStats:
+    def __init__(self):
+        self.offset = 0  # Position (octets) dans le journal jusqu'où les compteurs sont à jour
+        self.total = 0
+        self.minutes = 0
+        self.by_user = collections.Counter()
+        self.by_slot = collections.Counter()  # "jour-heure" -> réservations ("0-9" : lundi 9 h)
+        self.minutes_by_weekday = [0] * 7
+        self.first = None  # Dates (ISO) du premier et du dernier rendez-vous
+        self.last = None
+
+    def add(self, record):
+        day = datetime.date.fromisoformat(record["date"])
+        weekday = day.weekday()
+        slot = f"{weekday}-{int(record['start'][:2])}"
+        if record.get("status") == "cancelled":
+            self.total -= 1
+            self.minutes -= record["duration"]
+            self.minutes_by_weekday[weekday] -= record["duration"]
+            for counter, key in ((self.by_user, record["user"]), (self.by_slot, slot)):
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+            return
+        self.total += 1
+        self.minutes += record["duration"]
+        self.by_user[record["user"]] += 1
+        self.by_slot[slot] += 1
+        self.minutes_by_weekday[weekday] += record["duration"]
+        self.first = min(self.first or record["date"], record["date"])
+        self.last = max(self.last or record["date"], record["date"])
+
+    def utilization(self, windows):
+        # Minutes réservées / minutes ouvertes par les règles /dispos, par jour de semaine (None sans règle active)
+        if not self.first:
+            return [None] * 7
+        first, last = datetime.date.fromisoformat(self.first), datetime.date.fromisoformat(self.last)
+        result = []
+        for weekday in range(7):
+            # Nombre de ce jour de semaine entre le premier et le dernier rendez-vous
+            offset = (weekday - first.weekday()) % 7
+            occurrences = max(0, ((last - first).days - offset) // 7 + 1)
+            open_minutes = sum((end - start) // duration * duration for start, end, duration in windows[weekday])
+            result.append(self.minutes_by_weekday[weekday] / (open_minutes * occurrences)
+                          if open_minutes and occurrences else None)
+        return result
+
+    def to_dict(self):
+        return {"offset": self.offset, "total": self.total, "minutes": self.minutes, "by_user": self.by_user,
+                "by_slot": self.by_slot, "minutes_by_weekday": self.minutes_by_weekday,
+                "first": self.first, "last": self.last}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.offset = data["offset"]
+        stats.total = data["total"]
+        stats.minutes = data["minutes"]
+        stats.by_user = collections.Counter(data["by_user"])
+        stats.by_slot = collections.Counter(data["by_slot"])
+        stats.minutes_by_weekday = data["minutes_by_weekday"]
+        stats.first = data["first"]
+        stats.last = data["last"]
+        return stats
+
+
+class BookingLog:
+    def __init__(self, path, snapshot_every=100):
+        self.path = path
+        self.stats_path = path + ".stats.json"
+        self.snapshot_every = snapshot_every  # Nouvelles lignes lues avant sauvegarde des compteurs
+        self._stats = None
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        # Une ligne écrite d'un seul write en mode ajout : plusieurs processus peuvent partager le fichier
+        line = json.dumps({field: record.get(field) for field in FIELDS}, ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def records(self, offset=0):
+        # Lecture en flux : (position après la ligne, enregistrement) ; une dernière ligne incomplète est ignorée
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    return
+                offset += len(line)
+                if line.strip():
+                    yield offset, json.loads(line)
+
+    def _load_stats(self):
+        try:
+            with open(self.stats_path, encoding="utf-8") as f:
+                return BookingStats.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return BookingStats()
+
+    def save_stats(self):
+        with self._lock:
+            stats = self._stats
+            if stats is None:
+                return
+            tmp = f"{self.stats_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(stats.to_dict(), f)
+            os.replace(tmp, self.stats_path)
+            self._unsaved = 0
+
+    def stats(self):
+        # Compteurs à jour : seules les lignes ajoutées depuis le dernier appel sont lues
+        with self._lock:
+            if self._stats is None:
+                self._stats = self._load_stats()
+            if self._stats.offset > (os.path.getsize(self.path) if os.path.exists(self.path) else 0):
+                # Journal remplacé ou vidé : compteurs recalculés depuis le début
+                self._stats = BookingStats()
+            stats = self._stats
+            for offset, record in self.records(stats.offset):
+                stats.add(record)
+                stats.offset = offset
+                self._unsaved += 1
+            save = self._unsaved >= self.snapshot_every
+        if save:
+            self.save_stats()
+        return stats
+
+    def export(self, out, fmt="jsonl"):
+        # Copie en flux du journal (jsonl, csv ou parquet) ; renvoie le nombre de lignes
+        count = 0
+        if fmt == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+
+            schema = pyarrow.schema([("id", pyarrow.string()), ("booked_at", pyarrow.string()),
+                                     ("date", pyarrow.string()), ("start", pyarrow.string()),
+                                     ("duration", pyarrow.int32()), ("subject", pyarrow.string()),
+                                     ("user", pyarrow.string()), ("status", pyarrow.string())])
+            with pyarrow.parquet.ParquetWriter(out, schema) as writer:
+                batch = []
+                for _, record in self.records():
+                    batch.append(record)
+                    count += 1
+                    if len(batch) == EXPORT_BATCH:
+                        writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                        batch = []
+                if batch:
+                    writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+            return count
+
+        with open(out, "w", encoding="utf-8", newline="") if out != "-" else contextlib.nullcontext(sys.stdout) as f:
+            if fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                for _, record in self.records():
+                    writer.writerow(record)
+                    count += 1
+            else:
+                for _, record in self.records():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += 1
+        return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export du journal des réservations")
+    parser.add_argument("--log", default=os.getenv("BOOKING_LOG", "bookings.jsonl"), help="Journal JSONL")
+    parser.add_argument("--format", default="jsonl", choices=["jsonl", "csv", "parquet"],
+                        help="Format de sortie (parquet : pip install pyarrow)")
+    parser.add_argument("--out", default="-", help="Fichier de sortie (- : sortie standard, sauf parquet)")
+    args = parser.parse_args(argv)
+    count = BookingLog(args.log).export(args.out, args.format)
+    print(f"{count} réservations exportées", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
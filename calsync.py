@@ -0,0 +1,199 @@
+import bisect
+import datetime
+import hmac
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytz
+
+from freebusy import timezone, to_aware, parse_rfc3339, merge_intervals
+
+logger = logging.getLogger(__name__)
+
+
+def event_interval(event):
+    # (début, fin) d'un événement Calendar, ou None s'il ne bloque pas le créneau
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return None
+    start, end = event.get("start", {}), event.get("end", {})
+    if "dateTime" in start:
+        return parse_rfc3339(start["dateTime"]), parse_rfc3339(end["dateTime"])
+    if "date" in start:
+        # Événement sur la journée entière
+        first = datetime.date.fromisoformat(start["date"])
+        last = datetime.date.fromisoformat(end["date"])
+        return (timezone.localize(datetime.datetime.combine(first, datetime.time())),
+                timezone.localize(datetime.datetime.combine(last, datetime.time())))
+    return None
+
+
+class BusyIndex:
+    # Index mémoire des plages occupées : événements par id + tableau trié des débuts
+
+    def __init__(self):
+        self._events = {}
+        self._starts = []
+        self._entries = []
+        self._max_length = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def upsert(self, event_id, start, end):
+        with self._lock:
+            self._events[event_id] = (to_aware(start).timestamp(), to_aware(end).timestamp())
+            self._dirty = True
+
+    def remove(self, event_id):
+        with self._lock:
+            if self._events.pop(event_id, None) is not None:
+                self._dirty = True
+
+    def replace(self, events):
+        with self._lock:
+            self._events = {event_id: (to_aware(start).timestamp(), to_aware(end).timestamp())
+                            for event_id, (start, end) in events.items()}
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._events)
+
+    def _snapshot(self):
+        with self._lock:
+            if self._dirty:
+                self._entries = sorted(self._events.values())
+                self._starts = [start for start, _ in self._entries]
+                self._max_length = max((end - start for start, end in self._entries), default=0.0)
+                self._dirty = False
+            return self._starts, self._entries, self._max_length
+
+    def _scan(self, start, end):
+        starts, entries, max_length = self._snapshot()
+        idx = bisect.bisect_left(starts, end)
+        while idx > 0:
+            idx -= 1
+            if starts[idx] <= start - max_length:
+                break
+            if entries[idx][1] > start:
+                yield entries[idx]
+
+    def overlaps(self, start, end):
+        return next(self._scan(to_aware(start).timestamp(), to_aware(end).timestamp()), None) is not None
+
+    def busy(self, time_min, time_max):
+        found = self._scan(to_aware(time_min).timestamp(), to_aware(time_max).timestamp())
+        return merge_intervals(
+            (datetime.datetime.fromtimestamp(s, pytz.UTC), datetime.datetime.fromtimestamp(e, pytz.UTC))
+            for s, e in found
+        )
+
+
+class CalendarSync:
+    # Synchronisation incrémentale : une liste complète, puis uniquement les changements (syncToken),
+    # à intervalle régulier ou dès qu'une notification push arrive
+
+    def __init__(self, get_service, calendar_id, interval=60, on_change=None):
+        self.get_service = get_service
+        self.calendar_id = calendar_id
+        self.interval = interval
+        self.on_change = on_change  # Appelé avec chaque événement modifié ou annulé
+        self.index = BusyIndex()
+        self.ready = threading.Event()
+        self._sync_token = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _list(self, **params):
+        service = self.get_service()
+        page_token = None
+        while True:
+            response = service.events().list(calendarId=self.calendar_id, singleEvents=True, maxResults=2500,
+                                             pageToken=page_token, **params).execute()
+            yield from response.get("items", [])
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                self._sync_token = response.get("nextSyncToken")
+                return
+
+    def full_sync(self):
+        with self._lock:
+            now = datetime.datetime.now(pytz.UTC)
+            events = {}
+            # Seuls les événements qui se terminent après maintenant (timeMin) : l'historique n'est pas paginé
+            for event in self._list(showDeleted=False, timeMin=now.isoformat()):
+                interval = event_interval(event)
+                if interval and interval[1] > now:
+                    events[event["id"]] = interval
+            self.index.replace(events)
+            self.ready.set()
+            logger.info("Calendar sync complète : %d événements", len(events))
+
+    def pull(self):
+        # Applique les changements depuis le dernier syncToken ; 410 = token expiré, resynchronisation complète
+        if self._sync_token is None:
+            return self.full_sync()
+        from googleapiclient.errors import HttpError
+        with self._lock:
+            try:
+                changes = list(self._list(syncToken=self._sync_token, showDeleted=True))
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                self._sync_token = None
+                changes = None
+        if changes is None:
+            return self.full_sync()
+
+        for event in changes:
+            interval = event_interval(event)
+            if interval:
+                self.index.upsert(event["id"], *interval)
+            else:
+                self.index.remove(event["id"])
+            if self.on_change:
+                self.on_change(event)
+        return len(changes)
+
+    def notify(self):
+        # Déclenche une synchronisation immédiate (webhook Calendar ou simulation locale)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.pull()
+            except Exception:
+                logger.exception("Échec de la synchronisation Calendar")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="calendar-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def serve_webhook(self, port, token, host="127.0.0.1"):
+        # Récepteur des notifications push (events().watch) : seul un POST portant le token du canal
+        # (X-Goog-Channel-Token, champ "token" passé à watch) déclenche une synchro.
+        # Écoute en local par défaut, derrière le proxy HTTPS qui reçoit les notifications de Google.
+        sync = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received = self.headers.get("X-Goog-Channel-Token", "")
+                if not hmac.compare_digest(received.encode(), token.encode()):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                sync.notify()
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="calendar-webhook", daemon=True).start()
+        return server
@@ -0,0 +1,106 @@
+import datetime
+import threading
+
+# Les bibliothèques Google (lentes à importer) sont chargées au premier usage
+
+# Marge avant expiration à partir de laquelle le token est rafraîchi
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+class ClientRegistry:
+    # Clients Google partagés par tout le process :
+    # - credentials chargées une seule fois et rafraîchies avant expiration
+    # - documents de découverte parsés une seule fois
+    # - une connexion HTTP (httplib2 / requests) par thread, httplib2 n'étant pas thread-safe
+    # - feuilles gspread ouvertes une seule fois par thread
+
+    def __init__(self, load_credentials, request_builder=None, wrap_gspread=None):
+        self._load_credentials = load_credentials
+        self._request_builder = request_builder  # Fabrique de la classe HttpRequest (instrumentation)
+        self._wrap_gspread = wrap_gspread
+        self._creds = None
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load_credentials()
+            if self._needs_refresh(self._creds):
+                from google.auth.transport.requests import Request
+                self._creds.refresh(Request())
+            return self._creds
+
+    @staticmethod
+    def _needs_refresh(creds):
+        if not creds.valid:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth stocke l'expiration en UTC "naïf"
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now < REFRESH_MARGIN
+
+    def _document(self, name, version):
+        from googleapiclient import discovery_cache
+        with self._lock:
+            key = (name, version)
+            if key not in self._documents:
+                self._documents[key] = discovery_cache.get_static_doc(name, version)
+            return self._documents[key]
+
+    def _thread_cache(self):
+        if not hasattr(self._local, "services"):
+            self._local.services = {}
+            self._local.worksheets = {}
+            self._local.gspread = None
+        return self._local
+
+    def service(self, name, version):
+        local = self._thread_cache()
+        creds = self.credentials()
+        service = local.services.get((name, version))
+        if service is None:
+            import httplib2
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.discovery import build, build_from_document
+            http = AuthorizedHttp(creds, http=httplib2.Http())
+            document = self._document(name, version)
+            extra = {"requestBuilder": self._request_builder()} if self._request_builder else {}
+            if document:
+                service = build_from_document(document, http=http, **extra)
+            else:
+                service = build(name, version, http=http, **extra)
+            local.services[(name, version)] = service
+        return service
+
+    def calendar(self):
+        return self.service("calendar", "v3")
+
+    def gspread(self):
+        local = self._thread_cache()
+        creds = self.credentials()
+        if local.gspread is None:
+            import gspread
+            local.gspread = gspread.authorize(creds)
+            if self._wrap_gspread:
+                self._wrap_gspread(local.gspread)
+        return local.gspread
+
+    def worksheet(self, key=None, title=None):
+        # Feuille par ID (open_by_key) ou par nom (open), première feuille du classeur
+        local = self._thread_cache()
+        worksheet = local.worksheets.get((key, title))
+        if worksheet is None:
+            client = self.gspread()
+            spreadsheet = client.open_by_key(key) if key else client.open(title)
+            worksheet = spreadsheet.sheet1
+            local.worksheets[(key, title)] = worksheet
+        else:
+            self.credentials()
+        return worksheet
+
+    def reset(self):
+        # Oublie les clients du thread courant (ex. après une erreur de connexion)
+        self._local.__dict__.clear()
@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Coordination entre plusieurs processus / machines du bot :
+# - verrous à expiration (un créneau n'est réservé que par un worker à la fois)
+# - diffusion des invalidations de cache entre workers
+# - élection d'un leader pour les tâches de fond à instance unique
+# Deux backends : fichier SQLite (plusieurs processus sur une même machine) et Redis (plusieurs machines).
+
+
+class LockTimeout(RuntimeError):
+    pass
+
+
+class LockLost(RuntimeError):
+    # Verrou expiré ou repris par un autre worker pendant qu'on le tenait
+    pass
+
+
+class HeldLock:
+    # Verrou tenu, prolongé en tâche de fond ; check() avant une écriture qui suppose l'exclusion
+    def __init__(self, key, holder, ttl):
+        self.key = key
+        self.holder = holder
+        self.ttl = ttl
+        self.expires = time.monotonic() + ttl
+        self.lost = False
+
+    def check(self):
+        if self.lost or time.monotonic() >= self.expires:
+            raise LockLost(self.key)
+
+
+class Coordinator:
+    distributed = False  # True si les workers peuvent être sur des machines différentes
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._held = set()  # Verrous tenus par lock(), prolongés par le thread keep-alive
+        self._held_guard = threading.Lock()
+        self._keeper = None
+
+    def holder(self):
+        # Les verrous appartiennent à un thread : deux threads d'un même worker s'excluent aussi
+        return f"{self.owner}:{threading.get_ident()}"
+
+    def acquire(self, key, ttl, holder=None):
+        # Prend ou prolonge le verrou `key` pour `ttl` secondes ; False s'il appartient à un autre worker
+        raise NotImplementedError
+
+    def release(self, key, holder=None):
+        raise NotImplementedError
+
+    def get_value(self, key):
+        # Valeur partagée (sérialisable en JSON) entre workers ; None si absente ou expirée
+        raise NotImplementedError
+
+    def set_value(self, key, value, ttl):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel, callback):
+        # callback(message) est appelé dans un thread de fond pour les messages des autres workers
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key, ttl=30, wait=10, poll=0.05):
+        # Le verrou est prolongé tous les ttl / 3 tant qu'il est tenu (appels Google réessayés, batchs longs) ;
+        # HeldLock.check() lève LockLost si un prolongement a échoué ou n'a pas eu lieu à temps
+        holder = self.holder()
+        deadline = time.monotonic() + wait
+        while not self.acquire(key, ttl, holder):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(key)
+            time.sleep(poll)
+        held = HeldLock(key, holder, ttl)
+        with self._held_guard:
+            self._held.add(held)
+            if self._keeper is None:
+                self._keeper = threading.Thread(target=self._keep_alive, name="coordination-locks", daemon=True)
+                self._keeper.start()
+        try:
+            yield held
+        finally:
+            with self._held_guard:
+                self._held.discard(held)
+            self.release(key, holder)
+
+    def _keep_alive(self):
+        while True:
+            time.sleep(1.0)
+            with self._held_guard:
+                held_locks = list(self._held)
+            for held in held_locks:
+                if held.lost or held.expires - time.monotonic() > held.ttl * 2 / 3:
+                    continue
+                try:
+                    renewed = self.acquire(held.key, held.ttl, held.holder)
+                except Exception:
+                    logger.exception("Prolongement du verrou %s en échec", held.key)
+                    continue  # Nouvel essai à la seconde suivante, tant que le verrou n'a pas expiré
+                if renewed:
+                    held.expires = time.monotonic() + held.ttl
+                else:
+                    logger.error("Verrou %s perdu : repris par un autre worker", held.key)
+                    held.lost = True
+
+
+class LocalCoordinator(Coordinator):
+    # Un seul processus : verrous en mémoire, pas de diffusion
+    def __init__(self):
+        super().__init__()
+        self._locks = {}
+        self._values = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, key, ttl, holder=None):
+        holder = holder or self.holder()
+        with self._guard:
+            current = self._locks.get(key)
+            if current and current[0] != holder and current[1] > time.monotonic():
+                return False
+            self._locks[key] = (holder, time.monotonic() + ttl)
+            return True
+
+    def release(self, key, holder=None):
+        with self._guard:
+            if self._locks.get(key, (None,))[0] == (holder or self.holder()):
+                del self._locks[key]
+
+    def get_value(self, key):
+        with self._guard:
+            entry = self._values.get(key)
+            return entry[1] if entry and entry[0] > time.monotonic() else None
+
+    def set_value(self, key, value, ttl):
+        with self._guard:
+            self._values[key] = (time.monotonic() + ttl, value)
+
+    def publish(self, channel, message):
+        pass
+
+    def subscribe(self, channel, callback):
+        pass
+
+
+class SqliteCoordinator(Coordinator):
+    # Fichier SQLite partagé par les processus d'une même machine ; diffusion par une table lue périodiquement
+
+    def __init__(self, path, poll=1.0, retention=300):
+        super().__init__()
+        self.path = path
+        self.poll = poll
+        self.retention = retention  # Durée (s) de conservation des messages diffusés
+        self._local = threading.local()
+        self._subscribers = {}
+        self._thread = None
+        self._guard = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS coordination_locks (
+                    key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS coordination_values (
+                    key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS coordination_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL, sender TEXT NOT NULL, message TEXT NOT NULL, created REAL NOT NULL
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key, ttl, holder=None):
+        holder = holder or self.holder()
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM coordination_locks WHERE expires < ?", (now,))
+            row = conn.execute("SELECT owner, expires FROM coordination_locks WHERE key = ?", (key,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO coordination_locks (key, owner, expires) VALUES (?, ?, ?)",
+                         (key, holder, now + ttl))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, key, holder=None):
+        self._conn().execute("DELETE FROM coordination_locks WHERE key = ? AND owner = ?",
+                             (key, holder or self.holder()))
+
+    def get_value(self, key):
+        row = self._conn().execute("SELECT value FROM coordination_values WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_value(self, key, value, ttl):
+        self._conn().execute("INSERT OR REPLACE INTO coordination_values (key, value, expires) VALUES (?, ?, ?)",
+                             (key, json.dumps(value), time.time() + ttl))
+
+    def publish(self, channel, message):
+        self._conn().execute(
+            "INSERT INTO coordination_messages (channel, sender, message, created) VALUES (?, ?, ?, ?)",
+            (channel, self.owner, json.dumps(message), time.time()))
+
+    def subscribe(self, channel, callback):
+        with self._guard:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="coordination", daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        conn = self._conn()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM coordination_messages").fetchone()[0]
+        while True:
+            time.sleep(self.poll)
+            try:
+                rows = conn.execute(
+                    "SELECT id, channel, sender, message FROM coordination_messages WHERE id > ? ORDER BY id",
+                    (last_id,)).fetchall()
+                for id_, channel, sender, message in rows:
+                    last_id = id_
+                    if sender != self.owner:
+                        for callback in self._subscribers.get(channel, []):
+                            callback(json.loads(message))
+                conn.execute("DELETE FROM coordination_messages WHERE created < ?", (time.time() - self.retention,))
+            except Exception:
+                logger.exception("Lecture des messages de coordination en échec")
+
+
+class RedisCoordinator(Coordinator):
+    # Redis (ou compatible) partagé par toutes les machines : SET NX PX pour les verrous, PUBLISH pour la diffusion
+
+    distributed = True
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    _RENEW = ("local v = redis.call('get', KEYS[1]) "
+              "if v == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end "
+              "if not v then return redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2]) and 1 or 0 end return 0")
+
+    def __init__(self, url, prefix="planning:"):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._renew = self.redis.register_script(self._RENEW)
+        self._release = self.redis.register_script(self._RELEASE)
+        self._pubsub = None
+        self._subscribers = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, key, ttl, holder=None):
+        return bool(self._renew(keys=[self.prefix + key], args=[holder or self.holder(), int(ttl * 1000)]))
+
+    def release(self, key, holder=None):
+        self._release(keys=[self.prefix + key], args=[holder or self.holder()])
+
+    def get_value(self, key):
+        raw = self.redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_value(self, key, value, ttl):
+        self.redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def publish(self, channel, message):
+        self.redis.publish(self.prefix + channel, json.dumps({"sender": self.owner, "message": message}))
+
+    def subscribe(self, channel, callback):
+        with self._guard:
+            self._subscribers.setdefault(self.prefix + channel, []).append(callback)
+            if self._pubsub is None:
+                self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(**{self.prefix + channel: self._dispatch})
+                self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            else:
+                self._pubsub.subscribe(**{self.prefix + channel: self._dispatch})
+
+    def _dispatch(self, raw):
+        payload = json.loads(raw["data"])
+        if payload["sender"] == self.owner:
+            return
+        channel = raw["channel"].decode() if isinstance(raw["channel"], bytes) else raw["channel"]
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payload["message"])
+            except Exception:
+                logger.exception("Traitement d'un message de coordination en échec")
+
+
+def from_url(url, default_path):
+    # "" ou "sqlite:///chemin.db" -> SqliteCoordinator ; "redis://..." / "rediss://..." -> RedisCoordinator ;
+    # "local" -> un seul processus
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCoordinator(url)
+    if url == "local":
+        return LocalCoordinator()
+    return SqliteCoordinator(url[len("sqlite:///"):] if url.startswith("sqlite:///") else default_path)
+
+
+class Leadership:
+    # Élection d'un leader par verrou renouvelé : seul le leader exécute les tâches de fond à instance unique
+
+    def __init__(self, coordinator, name, ttl=30):
+        self.coordinator = coordinator
+        self.key = f"leader:{name}"
+        self.ttl = ttl
+        self.elected = threading.Event()
+        self._on_elected = []
+        self._on_demoted = []
+        self._thread = None
+
+    def is_leader(self):
+        return self.elected.is_set()
+
+    def on_elected(self, callback):
+        # Appelé chaque fois que ce worker devient leader ; réessayé à chaque renouvellement tant qu'il échoue
+        self._on_elected.append(callback)
+
+    def on_demoted(self, callback):
+        # Appelé quand ce worker perd le verrou (un autre worker a pris la main)
+        self._on_demoted.append(callback)
+
+    def _call(self, callbacks):
+        failed = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Tâche de changement de leader en échec")
+                failed.append(callback)
+        return failed
+
+    def _run(self):
+        pending = []
+        while True:
+            try:
+                leader = self.coordinator.acquire(self.key, self.ttl)
+            except Exception:
+                logger.exception("Élection du leader en échec")
+                leader = False
+            if leader and not self.elected.is_set():
+                logger.info("Ce worker devient leader (%s)", self.coordinator.owner)
+                self.elected.set()
+                pending = list(self._on_elected)
+            elif not leader and self.elected.is_set():
+                logger.warning("Ce worker n'est plus leader")
+                self.elected.clear()
+                pending = []
+                self._call(self._on_demoted)
+            if pending:
+                # Ex. port du récepteur encore tenu par l'ancien leader de la même machine : nouvel essai au tour suivant
+                pending = self._call(pending)
+            time.sleep(self.ttl / 3)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+            self._thread.start()
+        return self
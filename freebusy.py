@@ -0,0 +1,91 @@
+import bisect
+import datetime
+import functools
+import pytz
+
+from googleapi import execute_all
+
+TIMEZONE = "Europe/Paris"
+timezone = pytz.timezone(TIMEZONE)
+FREEBUSY_MAX_ITEMS = 50  # Nombre max d'agendas par requête freebusy (limite de l'API)
+
+
+# -- Conversion des dates
+@functools.lru_cache(maxsize=4096)
+def _local_tzinfo(hour):
+    # Les changements d'heure tombent sur une heure pile : le décalage est constant sur l'heure
+    return timezone.localize(hour).tzinfo
+
+
+def to_aware(dt):
+    # Les dates "naïves" du bot sont en heure de Paris
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=_local_tzinfo(dt.replace(minute=0, second=0, microsecond=0)))
+    return dt
+
+
+def to_utc_iso(dt):
+    return to_aware(dt).astimezone(pytz.UTC).isoformat()
+
+
+def parse_rfc3339(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+# -- Intervalles occupés
+def merge_intervals(intervals):
+    # Trie puis fusionne les intervalles qui se chevauchent ou se touchent
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def query_busy(service, calendar_ids, time_min, time_max):
+    # Une requête freebusy pour tout l'horizon par lot de FREEBUSY_MAX_ITEMS agendas,
+    # les lots étant envoyés ensemble (BatchHttpRequest)
+    busy = {}
+    calendar_ids = list(calendar_ids)
+    chunks = [calendar_ids[i:i + FREEBUSY_MAX_ITEMS] for i in range(0, len(calendar_ids), FREEBUSY_MAX_ITEMS)]
+    requests = [service.freebusy().query(body={
+        "timeMin": to_utc_iso(time_min),
+        "timeMax": to_utc_iso(time_max),
+        "timeZone": TIMEZONE,
+        "items": [{"id": calendar_id} for calendar_id in chunk],
+    }) for chunk in chunks]
+
+    for chunk, (response, error) in zip(chunks, execute_all(service, requests)):
+        if error is not None:
+            raise error
+        for calendar_id in chunk:
+            calendar = response.get("calendars", {}).get(calendar_id, {})
+            if calendar.get("errors"):
+                raise RuntimeError(f"freebusy en erreur pour {calendar_id} : {calendar['errors']}")
+            busy[calendar_id] = merge_intervals(
+                (parse_rfc3339(b["start"]), parse_rfc3339(b["end"])) for b in calendar.get("busy", [])
+            )
+    return busy
+
+
+def overlaps(busy, start, end):
+    # busy est trié et fusionné : seul l'intervalle qui précède `end` peut chevaucher
+    start, end = to_aware(start), to_aware(end)
+    idx = bisect.bisect_left(busy, (end,))
+    return idx > 0 and busy[idx - 1][1] > start
+
+
+def free_slots(slots, busy):
+    # Balayage : créneaux et intervalles occupés sont parcourus une seule fois, dans l'ordre
+    free = []
+    i = 0
+    for start, end, slot in sorted(((to_aware(s[0]), to_aware(s[1]), s) for s in slots), key=lambda k: k[0]):
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        if i < len(busy) and busy[i][0] < end:
+            continue
+        free.append(slot)
+    return free
@@ -0,0 +1,232 @@
+import functools
+import logging
+import random
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Couche d'exécution commune des appels Google : limitation de débit (seau à jetons par API),
+# réessais avec attente exponentielle aléatoire sur 429 / 5xx, disjoncteur quand Google est dégradé,
+# et regroupement des requêtes indépendantes en BatchHttpRequest.
+
+BATCH_MAX = 50  # Nombre max de requêtes par BatchHttpRequest (limite Calendar)
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # Jetons par seconde
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        # Bloque jusqu'à ce que n jetons soient disponibles
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= n or self._tokens >= self.burst:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    # Ouvert après `threshold` erreurs transitoires consécutives ; un appel d'essai passe après `cooldown` s
+    def __init__(self, name, threshold=5, cooldown=30):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.cooldown:
+                raise CircuitOpen(f"API {self.name} indisponible, nouvel essai dans moins de {self.cooldown} s")
+            # Semi-ouvert : on laisse passer un appel, le prochain échec rouvre pour un cycle complet
+            self._opened_at = time.monotonic() - self.cooldown + 1
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning("Disjoncteur %s ouvert après %d erreurs", self.name, self._failures)
+                    metrics.registry.inc("planning_circuit_open_total", api=self.name)
+                self._opened_at = time.monotonic()
+
+
+class Policy:
+    def __init__(self, name, rate, burst, retries=5, backoff=0.5, max_backoff=30, threshold=5, cooldown=30):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, threshold, cooldown)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, error=None):
+        # Attente exponentielle "full jitter", ou Retry-After si Google en fournit un
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, fn, transient=None, tokens=1):
+        transient = transient or is_transient
+        for attempt in range(self.retries + 1):
+            self.breaker.check()
+            self.bucket.take(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                if not transient(e):
+                    raise
+                self.breaker.failure()
+                if attempt == self.retries:
+                    raise
+                metrics.registry.inc("planning_api_retries_total", api=self.name)
+                time.sleep(self.delay(attempt, e))
+                continue
+            self.breaker.success()
+            return result
+
+
+# Débits par défaut : Calendar ~600 requêtes / min / utilisateur, Sheets 60 requêtes / min / utilisateur
+policies = {
+    "calendar": Policy("calendar", rate=10, burst=20),
+    "sheets": Policy("sheets", rate=1, burst=10),
+}
+
+
+def _status(error):
+    resp = getattr(error, "resp", None)  # googleapiclient HttpError
+    if resp is not None:
+        return getattr(resp, "status", None)
+    response = getattr(error, "response", None)  # gspread APIError (requests)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(error):
+    resp = getattr(error, "resp", None) or getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(resp.get("retry-after")) if resp is not None and resp.get("retry-after") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error):
+    status = _status(error)
+    if status in TRANSIENT_STATUSES:
+        return True
+    if status == 403:
+        content = getattr(error, "content", b"") or b""
+        return b"ateLimitExceeded" in content
+    # Erreurs réseau (connexion coupée, timeout) : la requête peut être rejouée
+    return status is None and (isinstance(error, OSError) or type(error).__name__ == "ServerNotFoundError")
+
+
+def _api_name(method_id):
+    return (method_id or "calendar").split(".")[0]
+
+
+# -- googleapiclient : chaque execute() passe par la politique de son API
+@functools.lru_cache(maxsize=None)
+def request_builder(base=None):
+    if base is None:
+        from googleapiclient.http import HttpRequest
+        base = HttpRequest
+
+    class PolicyHttpRequest(base):
+        def execute(self, *args, **kwargs):
+            policy = policies.get(_api_name(self.methodId)) or policies["calendar"]
+            return policy.call(lambda: super(PolicyHttpRequest, self).execute(*args, **kwargs))
+
+    return PolicyHttpRequest
+
+
+def execute_all(service, requests, api="calendar"):
+    # Requêtes indépendantes envoyées par BatchHttpRequest (BATCH_MAX par lot) ; seuls les éléments
+    # en échec transitoire sont renvoyés au lot suivant. Renvoie [(réponse, erreur)] dans l'ordre.
+    if len(requests) == 1:
+        try:
+            return [(requests[0].execute(), None)]
+        except Exception as e:
+            return [(None, e)]
+
+    policy = policies[api]
+    results = [(None, None)] * len(requests)
+    pending = list(range(len(requests)))
+    for attempt in range(policy.retries + 1):
+        failed = []
+
+        def collect(request_id, response, exception):
+            idx = int(request_id)
+            results[idx] = (response, exception)
+            if exception is not None and is_transient(exception):
+                failed.append(idx)
+
+        for i in range(0, len(pending), BATCH_MAX):
+            chunk = pending[i:i + BATCH_MAX]
+            policy.breaker.check()
+            policy.bucket.take(len(chunk))
+            batch = service.new_batch_http_request(callback=collect)
+            for idx in chunk:
+                batch.add(requests[idx], request_id=str(idx))
+            try:
+                batch.execute()
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                for idx in chunk:
+                    results[idx] = (None, e)
+                failed.extend(chunk)
+
+        if not failed:
+            policy.breaker.success()
+            break
+        policy.breaker.failure()
+        pending = sorted(set(failed))
+        if attempt < policy.retries:
+            metrics.registry.inc("planning_api_retries_total", value=len(pending), api=policy.name)
+            time.sleep(policy.delay(attempt))
+    return results
+
+
+# -- gspread : enveloppe la méthode request du client HTTP
+def wrap_gspread(client):
+    target = getattr(client, "http_client", client)
+    request = target.request
+    policy = policies["sheets"]
+
+    @functools.wraps(request)
+    def guarded_request(method, endpoint, *args, **kwargs):
+        # values:append n'est pas idempotent : seul un 429 (requête refusée) est réessayé
+        if ":append" in endpoint:
+            transient = lambda e: _status(e) == 429
+        else:
+            transient = is_transient
+        return policy.call(lambda: request(method, endpoint, *args, **kwargs), transient)
+
+    target.request = guarded_request
+    return client
@@ -0,0 +1,98 @@
+import collections
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    # File de travaux bornée, traitée par un pool de workers :
+    # - les travaux d'une même clé (utilisateur) s'exécutent un par un, dans l'ordre de soumission
+    # - au-delà de maxsize travaux en attente, submit lève QueueFull (contre-pression)
+    # - workers=0 : exécution immédiate dans le thread appelant (banc d'essai, débogage)
+
+    def __init__(self, workers=8, maxsize=256, name="jobs"):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.name = name
+        self._pending = {}  # clé -> deque de (soumis_à, fn, args)
+        self._ready = collections.deque()  # clés ayant du travail et aucun worker dessus
+        self._running = set()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def depth(self):
+        return self._size
+
+    def submit(self, key, fn, *args):
+        if not self.workers:
+            self._run(key, time.perf_counter(), fn, args)
+            return
+        with self._cond:
+            if self._size >= self.maxsize:
+                metrics.registry.inc("planning_jobs_rejected_total", queue=self.name)
+                raise QueueFull(self.name)
+            queue = self._pending.get(key)
+            if queue is None:
+                queue = self._pending[key] = collections.deque()
+                if key not in self._running:
+                    self._ready.append(key)
+            queue.append((time.perf_counter(), fn, args))
+            self._size += 1
+            self._start()
+            self._cond.notify()
+
+    def _start(self):
+        # Workers démarrés au premier travail
+        if not self._threads:
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"{self.name}-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _take(self):
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+            key = self._ready.popleft()
+            queue = self._pending[key]
+            submitted, fn, args = queue.popleft()
+            if not queue:
+                del self._pending[key]
+            self._running.add(key)
+            self._size -= 1
+            return key, submitted, fn, args
+
+    def _done(self, key):
+        with self._cond:
+            self._running.discard(key)
+            if key in self._pending:
+                self._ready.append(key)
+                self._cond.notify()
+
+    def _work(self):
+        while True:
+            key, submitted, fn, args = self._take()
+            try:
+                self._run(key, submitted, fn, args)
+            finally:
+                self._done(key)
+
+    def _run(self, key, submitted, fn, args):
+        started = time.perf_counter()
+        metrics.registry.observe("planning_job_wait_seconds", started - submitted, queue=self.name)
+        try:
+            fn(*args)
+        except Exception:
+            metrics.registry.inc("planning_job_errors_total", queue=self.name)
+            logger.exception("Travail en échec (%s, %s)", self.name, key)
+        finally:
+            metrics.registry.observe("planning_job_run_seconds", time.perf_counter() - started, queue=self.name)
@@ -0,0 +1,118 @@
+import datetime
+import hashlib
+import sqlite3
+import threading
+import time
+
+import pytz
+
+from freebusy import to_aware
+
+
+def event_id(calendar_id, start, user):
+    # Identifiant d'événement déterministe : les réessais d'une même réservation sont idempotents.
+    # Calendar accepte les caractères base32hex (0-9, a-v) : un hash hexadécimal convient.
+    key = f"{calendar_id}|{to_aware(start).isoformat()}|{user}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ReservationLedger:
+    # Registre local des créneaux réservés : un créneau est revendiqué de façon atomique
+    # (transaction SQLite + contrainte unique) avant l'insertion dans Calendar
+
+    def __init__(self, path="planning.db", pending_ttl=120):
+        self.path = path
+        self.pending_ttl = pending_ttl  # Une revendication non confirmée expire après ce délai (s)
+        self._local = threading.local()
+
+    def _create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS reservations (
+                calendar_id TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                event_id TEXT NOT NULL,
+                user TEXT,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (calendar_id, start)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS reservations_end ON reservations (calendar_id, end)")
+
+    def _conn(self):
+        # Connexion par thread, ouverte (et schéma créé) au premier usage
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _epoch(dt):
+        return int(to_aware(dt).timestamp())
+
+    def claim(self, calendar_id, start, end, user):
+        # Renvoie l'id d'événement à utiliser, ou None si le créneau chevauche une réservation existante
+        start_s, end_s = self._epoch(start), self._epoch(end)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM reservations WHERE end < ? OR (status = 'pending' AND created_at < ?)",
+                         (int(now), now - self.pending_ttl))
+            existing = conn.execute(
+                "SELECT event_id, user FROM reservations WHERE calendar_id = ? AND start < ? AND end > ?",
+                (calendar_id, end_s, start_s),
+            ).fetchall()
+            if existing:
+                conn.execute("ROLLBACK")
+                return None
+            eid = event_id(calendar_id, start, user)
+            conn.execute(
+                "INSERT INTO reservations (calendar_id, start, end, event_id, user, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (calendar_id, start_s, end_s, eid, user, now),
+            )
+            conn.execute("COMMIT")
+            return eid
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            return None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def confirm(self, calendar_id, start):
+        self._conn().execute("UPDATE reservations SET status = 'confirmed' WHERE calendar_id = ? AND start = ?",
+                             (calendar_id, self._epoch(start)))
+
+    def confirmed(self, calendar_id, start, user):
+        # True si cette même réservation (même id déterministe) est déjà confirmée
+        row = self._conn().execute("SELECT 1 FROM reservations WHERE event_id = ? AND status = 'confirmed'",
+                                   (event_id(calendar_id, start, user),)).fetchone()
+        return row is not None
+
+    def release(self, calendar_id, start):
+        self._conn().execute("DELETE FROM reservations WHERE calendar_id = ? AND start = ?",
+                             (calendar_id, self._epoch(start)))
+
+    def release_event(self, event_id):
+        # Renvoie (début, fin, utilisateur) de la réservation confirmée libérée, None si aucune :
+        # lecture et suppression dans la même transaction, une annulation n'est traitée qu'une fois
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT start, end, user, status FROM reservations WHERE event_id = ?",
+                               (event_id,)).fetchone()
+            conn.execute("DELETE FROM reservations WHERE event_id = ?", (event_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None or row[3] != "confirmed":
+            return None
+        return (datetime.datetime.fromtimestamp(row[0], pytz.UTC), datetime.datetime.fromtimestamp(row[1], pytz.UTC),
+                row[2])
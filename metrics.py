@@ -0,0 +1,356 @@
+import asyncio
+import bisect
+import cProfile
+import functools
+import io
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Métriques en mémoire exportées au format texte Prometheus (/metrics)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, fn):
+        # fn renvoie une valeur, ou un dict {label: valeur} (label "key")
+        with self._lock:
+            self._gauges[name] = fn
+
+    @contextmanager
+    def timed(self, name, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.buckets), list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{fmt(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for le, c in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {total}")
+                lines.append(f"{name}_count{fmt(labels)} {count}")
+
+        for name, fn in sorted(gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    lines.append(f"{name}{fmt([('key', key)])} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# -- Profilage échantillonné (cProfile sur une fraction des appels de listeners)
+class SamplingProfiler:
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.stats = None
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args, **kwargs):
+        # Un seul appel profilé à la fois (cProfile ne supporte pas les profils concurrents partout)
+        if not self.rate or random.random() >= self.rate or not self._busy.acquire(blocking=False):
+            return fn(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            self._busy.release()
+            with self._lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def report(self, limit=40):
+        with self._lock:
+            if self.stats is None:
+                return "Aucun échantillon (PROFILE_SAMPLE_RATE=0 ?)\n"
+            out = io.StringIO()
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+
+
+profiler = SamplingProfiler()
+
+
+# -- Listeners Bolt
+def listener(name):
+    # Mesure la durée totale du listener, le délai avant ack() et le temps entre ack() et la fin
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            return _async_listener(name, fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            acked = []
+            ack = kwargs.get("ack")
+            if ack is not None:
+                def timed_ack(*a, **k):
+                    acked.append(time.perf_counter())
+                    registry.observe("planning_ack_seconds", acked[-1] - started, listener=name)
+                    return ack(*a, **k)
+                kwargs["ack"] = timed_ack
+            try:
+                return profiler.run(fn, *args, **kwargs)
+            except Exception:
+                registry.inc("planning_listener_errors_total", listener=name)
+                raise
+            finally:
+                ended = time.perf_counter()
+                registry.inc("planning_listener_calls_total", listener=name)
+                registry.observe("planning_listener_seconds", ended - started, listener=name)
+                if acked:
+                    registry.observe("planning_ack_to_response_seconds", ended - acked[0], listener=name)
+        return wrapper
+    return decorator
+
+
+def _async_listener(name, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        acked = []
+        ack = kwargs.get("ack")
+        if ack is not None:
+            async def timed_ack(*a, **k):
+                acked.append(time.perf_counter())
+                registry.observe("planning_ack_seconds", acked[-1] - started, listener=name)
+                return await ack(*a, **k)
+            kwargs["ack"] = timed_ack
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            registry.inc("planning_listener_errors_total", listener=name)
+            raise
+        finally:
+            ended = time.perf_counter()
+            registry.inc("planning_listener_calls_total", listener=name)
+            registry.observe("planning_listener_seconds", ended - started, listener=name)
+            if acked:
+                registry.observe("planning_ack_to_response_seconds", ended - acked[0], listener=name)
+    return wrapper
+
+
+# -- Appels sortants
+def record_api_call(api, seconds, error=None, quota=False):
+    registry.inc("planning_api_calls_total", api=api)
+    registry.observe("planning_api_seconds", seconds, api=api)
+    if error:
+        registry.inc("planning_api_errors_total", api=api, error=error)
+    if quota:
+        registry.inc("planning_api_quota_errors_total", api=api)
+
+
+def _is_quota_error(status, content):
+    return status == 429 or (status == 403 and b"ateLimitExceeded" in (content or b""))
+
+
+@functools.lru_cache(maxsize=None)
+def request_builder():
+    # Classe HttpRequest de googleapiclient qui chronomètre chaque execute() (par methodId)
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import HttpRequest
+
+    class InstrumentedHttpRequest(HttpRequest):
+        def execute(self, *args, **kwargs):
+            api = self.methodId or "google"
+            t = time.perf_counter()
+            try:
+                result = super().execute(*args, **kwargs)
+            except HttpError as e:
+                status = e.resp.status
+                record_api_call(api, time.perf_counter() - t, error=str(status),
+                                quota=_is_quota_error(status, e.content))
+                raise
+            except Exception as e:
+                record_api_call(api, time.perf_counter() - t, error=type(e).__name__)
+                raise
+            record_api_call(api, time.perf_counter() - t)
+            return result
+
+    return InstrumentedHttpRequest
+
+
+def instrument_gspread(client):
+    # gspread 6 passe par client.http_client.request, les versions antérieures par client.request
+    target = getattr(client, "http_client", client)
+    request = target.request
+
+    @functools.wraps(request)
+    def timed_request(method, endpoint, *args, **kwargs):
+        api = f"sheets.{method.lower()}"
+        t = time.perf_counter()
+        try:
+            response = request(method, endpoint, *args, **kwargs)
+        except Exception as e:
+            code = getattr(getattr(e, "response", None), "status_code", None)
+            record_api_call(api, time.perf_counter() - t, error=str(code or type(e).__name__),
+                            quota=code == 429)
+            raise
+        record_api_call(api, time.perf_counter() - t)
+        return response
+
+    target.request = timed_request
+    return client
+
+
+def instrument_slack_client(client):
+    # Tous les appels du WebClient passent par api_call : on l'enveloppe sur l'instance
+    if getattr(client, "_instrumented", False):
+        return client
+    api_call = client.api_call
+
+    @functools.wraps(api_call)
+    def timed_api_call(api_method, *args, **kwargs):
+        t = time.perf_counter()
+        try:
+            response = api_call(api_method, *args, **kwargs)
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            record_api_call(f"slack.{api_method}", time.perf_counter() - t,
+                            error=str(status or type(e).__name__), quota=status == 429)
+            raise
+        record_api_call(f"slack.{api_method}", time.perf_counter() - t)
+        return response
+
+    client.api_call = timed_api_call
+    client._instrumented = True
+    return client
+
+
+def slack_middleware(context, next):
+    # Middleware global Bolt : le client créé pour chaque requête est instrumenté
+    client = context.get("client")
+    if client is not None:
+        instrument_slack_client(client)
+    next()
+
+
+def instrument_async_slack_client(client):
+    if getattr(client, "_instrumented", False):
+        return client
+    api_call = client.api_call
+
+    @functools.wraps(api_call)
+    async def timed_api_call(api_method, *args, **kwargs):
+        t = time.perf_counter()
+        try:
+            response = await api_call(api_method, *args, **kwargs)
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            record_api_call(f"slack.{api_method}", time.perf_counter() - t,
+                            error=str(status or type(e).__name__), quota=status == 429)
+            raise
+        record_api_call(f"slack.{api_method}", time.perf_counter() - t)
+        return response
+
+    client.api_call = timed_api_call
+    client._instrumented = True
+    return client
+
+
+async def async_slack_middleware(context, next):
+    client = context.get("client")
+    if client is not None:
+        instrument_async_slack_client(client)
+    await next()
+
+
+# -- Endpoint HTTP
+def serve(port, host="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body, content_type = registry.render(), "text/plain; version=0.0.4"
+            elif self.path.startswith("/profile"):
+                body, content_type = profiler.report(), "text/plain"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -1,17 +1,34 @@
+import time
+STARTED_AT = time.perf_counter()
+
+import bisect
+import contextlib
 import datetime
 import pytz
 import os
 import json
+import re
+import threading
+import uuid
 from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 from dotenv import load_dotenv
-import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
-from google.oauth2 import service_account
+from clients import ClientRegistry
+from freebusy import query_busy, overlaps, free_slots, merge_intervals, to_aware, parse_rfc3339
+from cache import TTLCache
+from sheetwriter import SheetWriter
+import slots as slotgen
+from ledger import ReservationLedger
+from calsync import CalendarSync
+from store import SheetStore, SqliteStore, SheetReplicator
+from jobs import JobQueue, QueueFull
+from precompute import Precomputer, Snapshot
+from slotindex import SlotIndex, TimeGrid
+from reminders import ReminderScheduler
+from bookinglog import BookingLog, DAY_NAMES
+import metrics
+import googleapi
+import teams
+import coordination
 
 load_dotenv()
 # -------- CONFIGURATION --------
@@ -21,86 +38,299 @@ SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
 CALENDAR_ID = os.getenv("CALENDAR_ID")
 SHEET_NAME = os.getenv("SHEET_NAME", "Disponibilités")
 SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE", "service_account.json")  # Chemin vers le fichier JSON de service account
-SERVICE_ACCOUNT_INFO = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
+SERVICE_ACCOUNT_JSON = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")  # Contenu JSON du service account (prioritaire sur le fichier)
 
 SCOPES = ["https://www.googleapis.com/auth/calendar", "https://www.googleapis.com/auth/spreadsheets"]
+SERVICE_ACCOUNT_SCOPES = SCOPES + ["https://www.googleapis.com/auth/drive"]  # drive : ouverture de la Sheet par son nom
 CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE", "credentials.json")  # Chemin vers le fichier de credentials OAuth2
 TOKEN_FILE = os.getenv("TOKEN_FILE", "token.json")  # Fichier pour stocker le token OAuth2
 SHEET_ID = os.getenv("SHEET_ID", "1yNTdEt5607pVyrrsp7Tiy8Vu1aOkZg-ucA6yr3kN1XA")  # ID Google Sheet
+CACHE_TTL = int(os.getenv("CACHE_TTL", "30"))  # Durée de vie (s) des lignes de la Sheet et des plages occupées en cache
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "512"))  # Nombre max d'entrées avant éviction LRU
+RULES_CACHE_TTL = int(os.getenv("RULES_CACHE_TTL", "3600"))  # Relecture (s) des règles /dispos (modifications faites à la main dans la Sheet)
+SLOT_HORIZON_WEEKS = int(os.getenv("SLOT_HORIZON_WEEKS", "2"))  # Nombre de semaines de créneaux générés
+RDV_PAGE_SIZE = max(1, min(int(os.getenv("RDV_PAGE_SIZE", "10")), 45))  # Créneaux par page de /rdv (limite Slack : 50 blocs)
+RDV_CURSOR_TTL = int(os.getenv("RDV_CURSOR_TTL", "900"))  # Durée de vie (s) d'une liste /rdv paginée
+BULK_MAX = int(os.getenv("BULK_MAX", "50"))  # Nombre max de rendez-vous créés par /rdv-serie
+PRECOMPUTE_INTERVAL = int(os.getenv("PRECOMPUTE_INTERVAL", "60"))  # Recalcul périodique (s) de la réponse /rdv, 0 = à la demande
+PRECOMPUTE_DAYS = int(os.getenv("PRECOMPUTE_DAYS", "14"))  # Jours de créneaux inclus dans la réponse précalculée
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))  # Workers qui traitent les commandes après ack(), 0 = dans le listener
+CALENDAR_RATE = float(os.getenv("CALENDAR_RATE", "10"))  # Requêtes Calendar par seconde (seau à jetons)
+SHEETS_RATE = float(os.getenv("SHEETS_RATE", "1"))  # Requêtes Sheets par seconde (quota : 60 / min / utilisateur)
+GOOGLE_RETRIES = int(os.getenv("GOOGLE_RETRIES", "5"))  # Réessais sur 429 / 5xx avant abandon
+COORDINATION_URL = os.getenv("COORDINATION_URL", "")  # "" = fichier DB_PATH (workers d'une même machine), "redis://…" entre machines
+TEAMS_CONFIG = os.getenv("TEAMS_CONFIG", "")  # Fichier JSON des consultants et équipes (vide = agenda CALENDAR_ID seul)
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "256"))  # Travaux en attente au-delà desquels les demandes sont refusées
+DB_PATH = os.getenv("DB_PATH", "planning.db")  # Base SQLite locale (registre des réservations)
+CALENDAR_SYNC_INTERVAL = int(os.getenv("CALENDAR_SYNC_INTERVAL", "60"))  # Intervalle (s) de synchro incrémentale, 0 = désactivée
+CALENDAR_WEBHOOK_PORT = int(os.getenv("CALENDAR_WEBHOOK_PORT", "0"))  # Port du récepteur de notifications push, 0 = aucun
+CALENDAR_WEBHOOK_HOST = os.getenv("CALENDAR_WEBHOOK_HOST", "127.0.0.1")  # Adresse d'écoute du récepteur (derrière un proxy HTTPS)
+CALENDAR_WEBHOOK_TOKEN = os.getenv("CALENDAR_WEBHOOK_TOKEN", "")  # Token du canal events().watch, exigé sur chaque notification
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")  # "sqlite" (SQLite + réplication vers la Sheet) ou "sheet"
+REPLICATION_INTERVAL = int(os.getenv("REPLICATION_INTERVAL", "5"))  # Intervalle (s) d'envoi des modifications vers la Sheet
+SHEET_WRITE_WINDOW = float(os.getenv("SHEET_WRITE_WINDOW", "0.05"))  # Fenêtre (s) de regroupement des écritures Sheets
+WARM_UP = os.getenv("WARM_UP", "1") == "1"  # Préchauffage des clients Google en arrière-plan après la connexion Slack
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port de l'endpoint /metrics (et /profile), 0 = désactivé
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Adresse d'écoute de /metrics (0.0.0.0 : toutes les interfaces)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Part des appels de listeners profilés (cProfile)
+REMINDER_OFFSETS = [int(m) for m in os.getenv("REMINDER_OFFSETS", "1440,60").split(",") if m.strip()]  # Rappels Slack (minutes avant le RDV), vide = aucun
+BOOKING_LOG = os.getenv("BOOKING_LOG", "bookings.jsonl")  # Journal local des réservations (JSONL, ajout seul), vide = désactivé
+SLACK_MESSAGE_RATE = float(os.getenv("SLACK_MESSAGE_RATE", "1"))  # Messages de rappel envoyés par seconde (limite chat.postMessage)
 
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
 timezone = pytz.timezone('Europe/Paris')
 TIMEZONE = "Europe/Paris"
 
-calendar_service = build("calendar", "v3", credentials=creds)
-sheet_client = gspread.authorize(creds)
-sheet = sheet_client.open_by_key(SHEET_ID).sheet1
-app = App(token=SLACK_BOT_TOKEN)
+# Aucun appel réseau à l'import : le token est vérifié pendant le préchauffage
+app = App(token=SLACK_BOT_TOKEN, token_verification_enabled=False)
+app.middleware(metrics.slack_middleware)
+metrics.instrument_slack_client(app.client)
+metrics.profiler.rate = PROFILE_SAMPLE_RATE
+cache = TTLCache(ttl=CACHE_TTL, maxsize=CACHE_MAXSIZE)
+metrics.registry.gauge("planning_cache", cache.stats)
+sheet_writer = SheetWriter(window=SHEET_WRITE_WINDOW)
+ledger = ReservationLedger(DB_PATH)
+# Verrous, invalidations et élection du leader partagés entre les workers
+coordinator = coordination.from_url(COORDINATION_URL, DB_PATH)
+leadership = coordination.Leadership(coordinator, "background")
+# Listes /rdv calculées une fois puis parcourues page par page (curseur côté serveur)
+slot_cursors = TTLCache(ttl=RDV_CURSOR_TTL, maxsize=1024)
+metrics.registry.gauge("planning_rdv_cursors", slot_cursors.stats)
+# Les listeners Bolt répondent tout de suite ; les appels Google sont faits par ces workers
+jobs = JobQueue(workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE)
+metrics.registry.gauge("planning_job_queue_depth", jobs.depth)
+# Rappels Slack des rendez-vous à venir, persistés dans DB_PATH et envoyés à débit limité
+reminders = ReminderScheduler(DB_PATH, lambda channel, text: app.client.chat_postMessage(channel=channel, text=text),
+                              rate=SLACK_MESSAGE_RATE)
+metrics.registry.gauge("planning_reminders_pending", reminders.pending)
+# Historique des réservations et compteurs d'usage tenus à jour au fil de l'eau (/rdv-stats)
+booking_log = BookingLog(BOOKING_LOG) if BOOKING_LOG else None
+# Consultants / équipes et index partagé de leurs plages occupées
+directory = teams.Directory.load(TEAMS_CONFIG, default_calendar=CALENDAR_ID)
+availability = teams.AvailabilityIndex(ttl=CACHE_TTL)
+
+# -------- AUTHENTIFICATION GOOGLE --------
+def load_service_account_credentials():
+    from google.oauth2 import service_account
+    if SERVICE_ACCOUNT_JSON:
+        return service_account.Credentials.from_service_account_info(json.loads(SERVICE_ACCOUNT_JSON),
+                                                                     scopes=SERVICE_ACCOUNT_SCOPES)
+    return service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SERVICE_ACCOUNT_SCOPES)
+
+def load_user_credentials():
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+    creds = None
+    if os.path.exists(TOKEN_FILE):
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open(TOKEN_FILE, 'w') as token:
+            token.write(creds.to_json())
+    return creds
+
+# Clients partagés entre les requêtes : compte de service (Calendar + Sheets) et compte OAuth utilisateur
+googleapi.policies["calendar"] = googleapi.Policy("calendar", rate=CALENDAR_RATE, burst=2 * CALENDAR_RATE,
+                                                  retries=GOOGLE_RETRIES)
+googleapi.policies["sheets"] = googleapi.Policy("sheets", rate=SHEETS_RATE, burst=10 * SHEETS_RATE,
+                                                retries=GOOGLE_RETRIES)
+
+def request_builder():
+    # Chaque execute() Google passe par la politique de débit / réessai (googleapi), chaque essai est chronométré
+    return googleapi.request_builder(metrics.request_builder())
+
+def wrap_gspread(client):
+    return googleapi.wrap_gspread(metrics.instrument_gspread(client))
+
+clients = ClientRegistry(load_service_account_credentials, request_builder=request_builder, wrap_gspread=wrap_gspread)
+user_clients = ClientRegistry(load_user_credentials, request_builder=request_builder, wrap_gspread=wrap_gspread)
+
+def get_calendar_service():
+    return user_clients.calendar()
+
+def slot_sheet():
+    return clients.worksheet(key=SHEET_ID)
+
+def rules_sheet():
+    return clients.worksheet(title=SHEET_NAME)
 
 # -- Google Sheets
-def load_sheet_rows():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open(SHEET_NAME).sheet1
-    return sheet.get_all_records()
-
-def get_slots_for_day(day_name, rows):
-    slots = []
-    for row in rows:
-        if row['Jour'].lower() != day_name.lower() or row['Actif'].strip().lower() != 'oui':
-            continue
-        try:
-            start_time = datetime.datetime.strptime(row['Heure début'], '%H:%M').time()
-            end_time = datetime.datetime.strptime(row['Heure fin'], '%H:%M').time()
-            duration = int(row['Durée créneau (min)'])
-        except:
-            continue
-        day = datetime.datetime.now()
-        while day.strftime('%A').lower() != day_name.lower():
-            day += datetime.timedelta(days=1)
-        current = datetime.datetime.combine(day.date(), start_time)
-        end = datetime.datetime.combine(day.date(), end_time)
-        while current + datetime.timedelta(minutes=duration) <= end:
-            slots.append((current, current + datetime.timedelta(minutes=duration)))
-            current += datetime.timedelta(minutes=duration)
-    return slots
+reported_rule_errors = set()
+
+def build_rule_index(values):
+    global reported_rule_errors
+    index = slotgen.RuleIndex.build(values)
+    # Lignes invalides signalées une seule fois : seulement quand la liste change d'une reconstruction à l'autre
+    errors = set(index.errors)
+    for error in index.errors:
+        if error not in reported_rule_errors:
+            print(f"⚠️ Règle /dispos ignorée : {error}")
+    reported_rule_errors = errors
+    return index
+
+def load_rule_index():
+    # Règles /dispos compilées une fois puis mises à jour sur place par /dispos (ici, et sur les autres workers par diffusion),
+    # et relues après RULES_CACHE_TTL pour voir les modifications faites à la main dans la Sheet
+    return cache.get_or_load("rule_index", lambda: build_rule_index(rules_sheet().get_all_values()),
+                             ttl=RULES_CACHE_TTL)
+
+def apply_rule(index, rule):
+    index.apply(rule)
+    return index
+
+# Créneaux proposés par /rdv (colonnes Date, Heure, Durée, Disponible)
+if STORE_BACKEND == "sqlite":
+    store = SqliteStore(DB_PATH, slot_sheet)
+    replicator = SheetReplicator(store, sheet_writer, interval=REPLICATION_INTERVAL, active=leadership.is_leader)
+else:
+    store = SheetStore(slot_sheet, cache, sheet_writer)
+    replicator = None
+
+def load_slot_rows():
+    return store.rows()
+
+def mark_slot_booked(row_idx):
+    store.mark_booked(row_idx)
+    precomputer.notify()
+    broadcast("slots")
+
+def get_slots_for_day(day_name, values=None):
+    # Créneaux de la prochaine occurrence du jour demandé (aujourd'hui compris)
+    rules = (slotgen.RuleIndex.build(values) if values is not None else load_rule_index()).windows
+    weekday = slotgen.weekday_index(day_name)
+    if weekday is None:
+        return []
+    day_rules = [rules[n] if n == weekday else [] for n in range(7)]
+    return slotgen.to_datetimes(*slotgen.expand(day_rules, weeks=1))
+
+def get_free_slots(service, weeks=SLOT_HORIZON_WEEKS):
+    # Tous les créneaux libres de l'horizon : expansion des règles puis retrait des plages occupées en bloc
+    starts, ends = slotgen.expand(load_rule_index().windows, weeks=weeks)
+    if not starts:
+        return []
+    busy = get_busy(service, slotgen.from_epoch_minutes(starts[0]), slotgen.from_epoch_minutes(max(ends)))
+    return slotgen.to_datetimes(*slotgen.subtract_busy(starts, ends, busy))
 
 # -- Google Calendar
-def get_calendar_service():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_INFO,
-        scopes=["https://www.googleapis.com/auth/calendar"]
-    )
-    return build("calendar", "v3", credentials=creds)
+def on_calendar_change(event):
+    # Un événement supprimé dans l'agenda libère son créneau dans le registre local
+    if event.get("status") == "cancelled":
+        released = ledger.release_event(event["id"])
+        reminders.cancel(event["id"])
+        if released is not None:
+            # Réservation du bot annulée : retirée des statistiques par une ligne d'annulation du journal
+            log_booking(event["id"], released[2], None, released[0], released[1], status="cancelled")
+    availability.invalidate(CALENDAR_ID)
+    cache.invalidate("slot_index")
+    precomputer.notify()
+
+calendar_sync = CalendarSync(clients.calendar, CALENDAR_ID, interval=CALENDAR_SYNC_INTERVAL,
+                             on_change=on_calendar_change)
+
+def get_busy(service, time_min, time_max):
+    # Index synchronisé disponible : simple lecture mémoire
+    if calendar_sync.ready.is_set():
+        return calendar_sync.index.busy(time_min, time_max)
+
+    # Sinon plages occupées mises en cache par jour : seuls les jours absents du cache sont demandés,
+    # en une seule requête freebusy couvrant tout l'intervalle manquant
+    first = to_aware(time_min).date()
+    last = to_aware(time_max).date()
+    days = [first + datetime.timedelta(days=n) for n in range((last - first).days + 1)]
+    cached = {day: cache.get(("busy", CALENDAR_ID, day)) for day in days}
+    missing = [day for day, busy in cached.items() if busy is None]
+
+    if missing:
+        start = timezone.localize(datetime.datetime.combine(missing[0], datetime.time.min))
+        end = timezone.localize(datetime.datetime.combine(missing[-1] + datetime.timedelta(days=1), datetime.time.min))
+        fetched = query_busy(service, [CALENDAR_ID], start, end)[CALENDAR_ID]
+        # Intervalles fusionnés : débuts et fins sont triés, chaque jour est une tranche trouvée par bisection
+        starts = [s for s, _ in fetched]
+        ends = [e for _, e in fetched]
+        for day in missing:
+            day_start = to_aware(datetime.datetime.combine(day, datetime.time.min))
+            day_end = to_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+            cached[day] = fetched[bisect.bisect_right(ends, day_start):bisect.bisect_left(starts, day_end)]
+            cache.set(("busy", CALENDAR_ID, day), cached[day])
+
+    return merge_intervals(interval for day in days for interval in cached[day])
+
+def apply_busy(event_id, start, end):
+    # Write-through : la réservation est ajoutée aux plages en cache et à l'index synchronisé
+    start, end = to_aware(start), to_aware(end)
+    day = start.astimezone(timezone).date()
+    while day <= end.astimezone(timezone).date():
+        cache.patch(("busy", CALENDAR_ID, day), lambda busy: merge_intervals(busy + [(start, end)]))
+        day += datetime.timedelta(days=1)
+    calendar_sync.index.upsert(event_id, start, end)
+    availability.invalidate(CALENDAR_ID)
+    cache.invalidate("slot_index")
+    precomputer.notify()
+
+def record_busy(event_id, start, end):
+    # Nos propres réservations : caches locaux mis à jour, puis ceux des autres workers
+    apply_busy(event_id, start, end)
+    broadcast("booked", id=event_id, start=to_aware(start).isoformat(), end=to_aware(end).isoformat())
+
+# -- Coordination entre workers
+def broadcast(kind, **data):
+    coordinator.publish("invalidate", dict(data, kind=kind))
+
+def on_broadcast(message):
+    # Modification faite par un autre worker
+    kind = message["kind"]
+    if kind == "booked":
+        apply_busy(message["id"], parse_rfc3339(message["start"]), parse_rfc3339(message["end"]))
+        return
+    if kind == "rules":
+        # La règle modifiée est appliquée sur place à l'index en cache, sans relire la Sheet
+        rule = slotgen.AvailabilityRule.parse(*message["rule"])
+        cache.patch("rule_index", lambda index: apply_rule(index, rule))
+        cache.invalidate("slot_index")
+    elif kind == "slots":
+        cache.invalidate("slots")
+    precomputer.notify()
+
+@contextlib.contextmanager
+def slot_locks(starts):
+    # Un verrou par (agenda, jour), pris dans l'ordre : deux workers ne réservent pas le même jour en même temps.
+    # Renvoie check(), à appeler juste avant l'insertion Calendar : LockLost si un verrou n'a pas pu être prolongé
+    with contextlib.ExitStack() as stack:
+        held = [stack.enter_context(coordinator.lock(f"slot:{CALENDAR_ID}:{day.isoformat()}"))
+                for day in sorted({to_aware(start).astimezone(timezone).date() for start in starts})]
+
+        def check():
+            for lock in held:
+                lock.check()
+        yield check
+
+def locked_busy(service, time_min, time_max):
+    # Sous verrou : entre machines, le cache et l'index local peuvent ignorer une réservation toute récente
+    # d'un autre worker, on relit donc Calendar ; sur une seule machine le registre SQLite partagé suffit
+    if coordinator.distributed:
+        return query_busy(service, [CALENDAR_ID], time_min, time_max)[CALENDAR_ID]
+    return get_busy(service, time_min, time_max)
 
 def is_slot_free(service, start, end):
-    # Convertir en fuseau horaire et en ISO 8601
-    start_utc = start.astimezone(pytz.UTC).isoformat()
-    end_utc = end.astimezone(pytz.UTC).isoformat()
-
-    events = service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=start_utc,
-        timeMax=end_utc,
-        singleEvents=True
-    ).execute().get("items", [])
-    return len(events) == 0
+    return not overlaps(get_busy(service, start, end), start, end)
 
-@app.action("book_meeting")
-def handle_booking(ack, body, respond):
-    ack()
-    user = body["user"]["username"]
-    value = body["actions"][0]["value"]
-    start_str, end_str = value.split('|')
-    start = datetime.datetime.fromisoformat(start_str)
-    end = datetime.datetime.fromisoformat(end_str)
-    service = get_calendar_service()
+def filter_free_slots(service, slots):
+    # Un seul aller-retour freebusy pour tous les créneaux, quel que soit leur nombre
+    if not slots:
+        return []
+    time_min = min(slot[0] for slot in slots)
+    time_max = max(slot[1] for slot in slots)
+    return free_slots(slots, get_busy(service, time_min, time_max))
 
+def build_event(summary, start, end, event_id=None):
     event = {
-        "summary": f"Rendez-vous avec {user}",
-        "start": {"dateTime": start.isoformat(), "timeZone": "Europe/Paris"},
-        "end": {"dateTime": end.isoformat(), "timeZone": "Europe/Paris"},
+        "summary": summary,
+        "start": {"dateTime": start.isoformat(), "timeZone": TIMEZONE},
+        "end": {"dateTime": end.isoformat(), "timeZone": TIMEZONE},
         "reminders": {
             "useDefault": False,
             "overrides": [
@@ -109,351 +339,759 @@ def handle_booking(ack, body, respond):
             ]
         }
     }
+    if event_id:
+        event["id"] = event_id
+    return event
 
-    service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-    respond(f"✅ Rendez-vous réservé : {start.strftime('%H:%M')} → {end.strftime('%H:%M')}")
+def recover_existing_event(service, event):
+    # Insertion refusée (409, id déjà utilisé) : réessai d'une réservation déjà créée,
+    # ou ancien événement annulé à réactiver
+    created = service.events().get(calendarId=CALENDAR_ID, eventId=event["id"]).execute()
+    if created.get("status") == "cancelled":
+        created = service.events().update(calendarId=CALENDAR_ID, eventId=event["id"],
+                                          body=dict(event, status="confirmed")).execute()
+    return created
 
+def insert_event(service, summary, start, end, event_id=None):
+    from googleapiclient.errors import HttpError
+    event = build_event(summary, start, end, event_id)
+    try:
+        created = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+    except HttpError as e:
+        if e.resp.status != 409 or not event_id:
+            raise
+        created = recover_existing_event(service, event)
+    record_busy(created["id"], start, end)
+    return created
 
-@app.command("/dispos")
-def open_availability_modal(ack, body, client):
-    ack()
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "update_availability",
-            "title": {"type": "plain_text", "text": "Modifier mes créneaux"},
-            "submit": {"type": "plain_text", "text": "Mettre à jour"},
-            "blocks": [
-                {
-                    "type": "input",
-                    "block_id": "day_block",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "day",
-                        "placeholder": {"type": "plain_text", "text": "Jour"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": j}, "value": j}
-                            for j in ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
-                        ],
-                    },
-                    "label": {"type": "plain_text", "text": "Jour de la semaine"},
-                },
-                {
-                "type": "input",
-                "block_id": "start_time_block",
-                "label": {"type": "plain_text", "text": "Heure de début"},
-                "element": {
-                    "type": "static_select",
-                    "action_id": "start_time_input",
-                    "placeholder": {"type": "plain_text", "text": "Choisis une heure"},
-                    "options": [
-                        {
-                            "text": {"type": "plain_text", "text": "09:00"},
-                            "value": "09:00"
-                        },
-                        {
-                            "text": {"type": "plain_text", "text": "10:00"},
-                            "value": "10:00"
-                        },
-                        {
-                            "text": {"type": "plain_text", "text": "11:00"},
-                            "value": "11:00"
-                        },
-                        {
-                            "text": {"type": "plain_text", "text": "14:00"},
-                            "value": "14:00"
-                        },
-                        {
-                            "text": {"type": "plain_text", "text": "15:00"},
-                            "value": "15:00"
-                        },
-                        {
-                            "text": {"type": "plain_text", "text": "16:00"},
-                            "value": "16:00"
-                        }
-                    ]
-                }
-            },{
-                    "type": "input",
-                    "block_id": "end_time_block",
-                    "label": {"type": "plain_text", "text": "Heure de début"},
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "end_time_input",
-                        "placeholder": {"type": "plain_text", "text": "Choisis une heure"},
-                        "options": [
-                            {
-                                "text": {"type": "plain_text", "text": "09:00"},
-                                "value": "09:00"
-                            },
-                            {
-                                "text": {"type": "plain_text", "text": "10:00"},
-                                "value": "10:00"
-                            },
-                            {
-                                "text": {"type": "plain_text", "text": "11:00"},
-                                "value": "11:00"
-                            },
-                            {
-                                "text": {"type": "plain_text", "text": "14:00"},
-                                "value": "14:00"
-                            },
-                            {
-                                "text": {"type": "plain_text", "text": "15:00"},
-                                "value": "15:00"
-                            },
-                            {
-                                "text": {"type": "plain_text", "text": "16:00"},
-                                "value": "16:00"
-                            }
-                        ]
-                    }
-                },
-                {
-                    "type": "input",
-                    "block_id": "duration_block",
-                    "element": {
-                        "type": "plain_text_input",
-                        "action_id": "duration",
-                        "placeholder": {"type": "plain_text", "text": "ex: 30"},
-                    },
-                    "label": {"type": "plain_text", "text": "Durée des créneaux (en minutes)"},
-                },
-                {
-                    "type": "input",
-                    "block_id": "active_block",
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "active",
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "Oui"}, "value": "oui"},
-                            {"text": {"type": "plain_text", "text": "Non"}, "value": "non"},
-                        ],
-                    },
-                    "label": {"type": "plain_text", "text": "Activer ?"},
-                },
-            ],
-        }
-    )
-    
-    
-@app.view("update_availability")
-def handle_submission(ack, body, view, respond):
-    ack()
-
-    values = view["state"]["values"]
-    jour = values["day_block"]["day"]["selected_option"]["value"]
-    heure_debut = view["state"]["values"]["start_time_block"]["start_time_input"]["selected_option"]["value"]
-    heure_fin = view["state"]["values"]["end_time_block"]["end_time_input"]["selected_option"]["value"]
-    duree = values["duration_block"]["duration"]["value"]
-    actif = values["active_block"]["active"]["selected_option"]["value"]
+def schedule_reminders(event_id, slack_id, summary, start):
+    # Un DM par délai de REMINDER_OFFSETS ; remplace ceux d'une tentative précédente de la même réservation
+    if not slack_id or not REMINDER_OFFSETS:
+        return
+    start = to_aware(start)
+    local = start.astimezone(timezone)
+    reminders.cancel(event_id)
+    for minutes in REMINDER_OFFSETS:
+        due = (start - datetime.timedelta(minutes=minutes)).timestamp()
+        if due <= time.time():
+            continue
+        delay = f"{minutes // 60} h" if minutes % 60 == 0 else f"{minutes} min"
+        reminders.schedule(event_id, slack_id, due,
+                           f"⏰ Rappel : {summary} le {local.strftime('%d/%m')} à {local.strftime('%H:%M')} (dans {delay})",
+                           expires=start.timestamp())
 
-    # Chargement + modification du Google Sheet
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open(SHEET_NAME).sheet1
-    rows = sheet.get_all_records()
+def log_booking(event_id, user, summary, start, end, status="booked"):
+    if booking_log is None:
+        return
+    local = to_aware(start).astimezone(timezone)
+    booking_log.append({
+        "id": event_id,
+        "booked_at": datetime.datetime.now(timezone).isoformat(timespec="seconds"),
+        "date": local.date().isoformat(),
+        "start": local.strftime("%H:%M"),
+        "duration": int((to_aware(end) - to_aware(start)).total_seconds() // 60),
+        "subject": summary,
+        "user": user,
+        "status": status,
+    })
 
-    updated = False
-    for idx, row in enumerate(rows, start=2):  # Ligne 1 = header
-        if row["Jour"].lower() == jour.lower():
-            sheet.update(f"B{idx}", heure_debut)
-            sheet.update(f"C{idx}", heure_fin)
-            sheet.update(f"D{idx}", duree)
-            sheet.update(f"E{idx}", actif)
-            updated = True
-            break
+def on_booked(event_id, user, slack_id, summary, start, end):
+    # Réservation créée : ligne du journal local et rappels Slack
+    log_booking(event_id, user, summary, start, end)
+    schedule_reminders(event_id, slack_id, summary, start)
 
-    if not updated:
-        # Ajouter une nouvelle ligne
-        sheet.append_row([jour, heure_debut, heure_fin, duree, actif])
+def book_event(service, summary, start, end, user, slack_id=None):
+    # Revendique le créneau dans le registre local avant l'insertion : deux clics simultanés
+    # ne peuvent pas réserver le même créneau. Renvoie None si le créneau est déjà pris.
+    with slot_locks([start]) as check_locks:
+        if coordinator.distributed and overlaps(locked_busy(service, start, end), start, end):
+            return None
+        event_id = ledger.claim(CALENDAR_ID, start, end, user)
+        if event_id is None:
+            return None
+        try:
+            check_locks()
+            created = insert_event(service, summary, start, end, event_id)
+        except Exception:
+            ledger.release(CALENDAR_ID, start)
+            raise
+        ledger.confirm(CALENDAR_ID, start)
+        on_booked(created["id"], user, slack_id, summary, start, end)
+        return created
 
-    respond(f"✅ Créneaux mis à jour pour *{jour}* : {heure_debut} → {heure_fin} ({duree}min) / Actif : {actif}")
+def book_events(service, items, user, slack_id=None):
+    # Réservation groupée : items = [(début, fin, sujet)] ; renvoie un statut par item, dans l'ordre.
+    # Une seule lecture des plages occupées, puis toutes les insertions dans un BatchHttpRequest.
+    items = [(to_aware(start), to_aware(end), subject) for start, end, subject in items]
+    report = [None] * len(items)
+    if not items:
+        return report
+    with slot_locks([start for start, _, _ in items]) as check_locks:
+        busy = locked_busy(service, min(i[0] for i in items), max(i[1] for i in items))
+        _book_items(service, items, user, busy, report, slack_id, check_locks)
+    return report
 
+def _book_items(service, items, user, busy, report, slack_id, check_locks):
+    now = datetime.datetime.now(timezone)
 
-# -------- AUTHENTIFICATION GOOGLE --------
-def get_calendar_service():
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    claimed = []
+    accepted_end = None  # Fin la plus tardive des items déjà retenus (parcours par début croissant)
+    for i in sorted(range(len(items)), key=lambda i: items[i][0]):
+        start, end, subject = items[i]
+        if start < now:
+            report[i] = "passé"
+        elif ledger.confirmed(CALENDAR_ID, start, user):
+            # Même série déjà créée (demande renvoyée) : rien à refaire
+            report[i] = "déjà réservé"
+        elif overlaps(busy, start, end) or (accepted_end is not None and start < accepted_end):
+            report[i] = "conflit"
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
-    return build('calendar', 'v3', credentials=creds)
+            event_id = ledger.claim(CALENDAR_ID, start, end, user)
+            if event_id is None:
+                report[i] = "conflit"
+                continue
+            claimed.append((i, event_id))
+            accepted_end = max(accepted_end or end, end)
 
-# -------- BOT SLACK --------
+    try:
+        check_locks()
+    except coordination.LockLost:
+        for i, _ in claimed:
+            ledger.release(CALENDAR_ID, items[i][0])
+        raise
+    events = [build_event(f"{items[i][2]} - {user}", items[i][0], items[i][1], event_id) for i, event_id in claimed]
+    requests = [service.events().insert(calendarId=CALENDAR_ID, body=event) for event in events]
+    for (i, event_id), event, (created, error) in zip(claimed, events, googleapi.execute_all(service, requests)):
+        start, end, subject = items[i]
+        try:
+            if error is not None:
+                if getattr(getattr(error, "resp", None), "status", None) != 409:
+                    raise error
+                # 409 : insertion réessayée après une réponse perdue, ou ancien événement annulé
+                # (l'id déterministe est réutilisé) ; le créneau n'était pas confirmé dans le registre
+                recover_existing_event(service, event)
+        except Exception as e:
+            ledger.release(CALENDAR_ID, start)
+            report[i] = f"erreur ({e})"
+            continue
+        ledger.confirm(CALENDAR_ID, start)
+        record_busy(event_id, start, end)
+        report[i] = "réservé"
+        on_booked(event_id, user, slack_id, f"{subject} - {user}", start, end)
 
-# Commande Slack : /rdv
-@app.command("/rdv")
-def handle_rdv(ack, body, client):
-    ack()
-    rows = sheet.get_all_records()
+# -- Logique des commandes (partagée entre le mode synchrone et le mode asyncio)
+def parse_meeting_value(value):
+    start_str, end_str = value.split('|')
+    return datetime.datetime.fromisoformat(start_str), datetime.datetime.fromisoformat(end_str)
+
+def parse_slot_value(value):
+    row_idx, date_str, time_str, duration = value.split("|")
+    start = datetime.datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+    end = start + datetime.timedelta(minutes=int(duration))
+    return int(row_idx), date_str, time_str, int(duration), start, end
+
+def parse_rdv_submission(values):
+    start_value = values["start_time_block"]["start_time_input"]["selected_option"]["value"]
+    duration_min = int(values["duration_block"]["duration_input"]["selected_option"]["value"])
+    subject = values["subject_block"]["subject_input"]["value"]
+
+    if "T" in start_value:
+        # Créneau choisi dans la liste des créneaux libres : "AAAA-MM-JJTHH:MM"
+        start_dt = datetime.datetime.fromisoformat(start_value)
+    else:
+        # Ancien modal (heure seule) : créneau du jour
+        start_dt = datetime.datetime.combine(datetime.date.today(),
+                                             datetime.datetime.strptime(start_value, "%H:%M").time())
+    start_hour = start_dt.strftime("%H:%M")
+    end_dt = start_dt + datetime.timedelta(minutes=duration_min)
+    return start_hour, duration_min, subject, start_dt, end_dt
+
+def append_booking_row(date, start_hour, duration_min, subject, user):
+    store.append_booking([str(date), start_hour, f"{duration_min} min", subject, user])
+    precomputer.notify()
+    broadcast("slots")
+
+def parse_bulk_request(text):
+    # Une ligne par rendez-vous : "AAAA-MM-JJ HH:MM durée [RRULE] [sujet]",
+    # ex. "2026-11-02 10:00 60 FREQ=WEEKLY;COUNT=10 Point hebdo" ou une liste collée de dates.
+    from dateutil import rrule
+    items = []
+    for n, line in enumerate(text.strip().splitlines(), start=1):
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            start = datetime.datetime.strptime(f"{parts[0]} {parts[1]}", "%Y-%m-%d %H:%M")
+            duration = datetime.timedelta(minutes=int(parts[2]))
+        except (IndexError, ValueError):
+            raise ValueError(f"ligne {n} : attendu « AAAA-MM-JJ HH:MM durée [RRULE] [sujet] »")
+        rest = parts[3:]
+        starts = [start]
+        if rest and "FREQ=" in rest[0].upper():
+            rule = rest.pop(0)
+            try:
+                starts = list(rrule.rrulestr(rule.split(":", 1)[-1], dtstart=start)[:BULK_MAX + 1])
+            except ValueError as e:
+                raise ValueError(f"ligne {n} : RRULE invalide ({e})")
+        subject = " ".join(rest) or "RDV"
+        items.extend((s, s + duration, subject) for s in starts)
+        if len(items) > BULK_MAX:
+            raise ValueError(f"au plus {BULK_MAX} rendez-vous par demande")
+    return items
+
+def bulk_reply(user, text, slack_id=None):
+    try:
+        items = parse_bulk_request(text)
+    except ValueError as e:
+        return f"❌ Demande invalide : {e}"
+    if not items:
+        return "Usage : /rdv-serie AAAA-MM-JJ HH:MM durée [FREQ=WEEKLY;COUNT=10] [sujet] (une ligne par rendez-vous)"
+
+    report = book_events(clients.calendar(), items, user, slack_id)
+    # Une seule écriture dans la Sheet pour tous les rendez-vous créés
+    rows = [[start.strftime("%Y-%m-%d"), start.strftime("%H:%M"), f"{int((end - start).total_seconds() // 60)} min",
+             subject, user] for (start, end, subject), status in zip(items, report) if status == "réservé"]
+    if rows:
+        store.append_bookings(rows)
+        precomputer.notify()
+        broadcast("slots")
+
+    icons = {"réservé": "✅", "déjà réservé": "✅", "conflit": "❌", "passé": "❌"}
+    lines = [f"{icons.get(status, '⚠️')} {start.strftime('%Y-%m-%d %H:%M')} → {end.strftime('%H:%M')} {subject} : {status}"
+             for (start, end, subject), status in zip(items, report)]
+    booked = sum(1 for status in report if status in ("réservé", "déjà réservé"))
+    return f"Série : {booked}/{len(items)} rendez-vous réservés\n" + "\n".join(lines)
+
+def available_slots(service):
+    candidates = []
+    for idx, row in store.available_rows():
+        date = row["Date"]
+        time = row["Heure"]
+        duration = int(row["Durée"])
+        start = datetime.datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+        end = start + datetime.timedelta(minutes=duration)
+        candidates.append((start, end, idx, date, time, duration))
+
+    # Écarte les créneaux déjà pris dans l'agenda (une seule requête freebusy)
+    return [(idx, date, time, duration) for _, _, idx, date, time, duration in filter_free_slots(service, candidates)]
+
+def open_slot_cursor(service):
+    # Calcule la liste complète une seule fois ; les pages suivantes sont lues dans slot_cursors
+    cursor_id = uuid.uuid4().hex[:16]
+    slots = available_slots(service)
+    slot_cursors.set(cursor_id, slots)
+    return cursor_id, len(slots)
+
+def parse_page_value(value):
+    cursor_id, page = value.split("|")
+    return cursor_id, int(page)
+
+def slot_page_blocks(cursor_id, page):
+    # Page de l'instantané précalculé si possible, sinon rendue depuis le curseur ; None si le curseur a expiré
+    snapshot = precomputer.current()
+    if snapshot is not None and cursor_id == snapshot_cursor(snapshot.version):
+        return snapshot.pages[min(max(page, 0), len(snapshot.pages) - 1)]
+    slots = slot_cursors.get(cursor_id)
+    if slots is None:
+        # Curseur ouvert par un autre worker (ou expiré) : la page est reprise de l'instantané local
+        if snapshot is not None:
+            return snapshot.pages[min(max(page, 0), len(snapshot.pages) - 1)]
+        return None
+    return render_slot_page(cursor_id, slots, page)
+
+def render_slot_page(cursor_id, slots, page):
+    pages = max(1, -(-len(slots) // RDV_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
 
     blocks = []
-    for idx, row in enumerate(rows):
-        if row["Disponible"] == "✅":
-            date = row["Date"]
-            time = row["Heure"]
-            duration = int(row["Durée"])
-            label = f"{date} - {time} ({duration} min)"
-            value = f"{idx}|{date}|{time}|{duration}"
-            blocks.append({
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": f"*{label}*"},
-                "accessory": {
-                    "type": "button",
-                    "text": {"type": "plain_text", "text": "Réserver"},
-                    "action_id": "book_slot",
-                    "value": value
-                }
-            })
-
-    if not blocks:
-        client.chat_postMessage(channel=body["user_id"], text="Aucun créneau disponible.")
-        return
+    for idx, date, time, duration in slots[page * RDV_PAGE_SIZE:(page + 1) * RDV_PAGE_SIZE]:
+        label = f"{date} - {time} ({duration} min)"
+        value = f"{idx}|{date}|{time}|{duration}"
+        blocks.append({
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": f"*{label}*"},
+            "accessory": {
+                "type": "button",
+                "text": {"type": "plain_text", "text": "Réserver"},
+                "action_id": "book_slot",
+                "value": value
+            }
+        })
 
-    client.chat_postMessage(
-        channel=body["user_id"],
-        text="Voici les créneaux disponibles :",
-        blocks=blocks
-    )
+    if pages > 1:
+        blocks.append({
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f"Page {page + 1}/{pages} · {len(slots)} créneaux"}],
+        })
+        buttons = []
+        if page > 0:
+            buttons.append({"type": "button", "text": {"type": "plain_text", "text": "◀ Précédents"},
+                            "action_id": "rdv_page_prev", "value": f"{cursor_id}|{page - 1}"})
+        if page < pages - 1:
+            buttons.append({"type": "button", "text": {"type": "plain_text", "text": "Suivants ▶"},
+                            "action_id": "rdv_page_next", "value": f"{cursor_id}|{page + 1}"})
+        blocks.append({"type": "actions", "elements": buttons})
+    return blocks
 
-@app.action("book_slot")
-def handle_booking(ack, body, client):
-    ack()
-    user = body["user"]["username"]
-    value = body["actions"][0]["value"]
-    row_idx, date_str, time_str, duration = value.split("|")
-    row_idx = int(row_idx)
-    duration = int(duration)
+# -- Réponse /rdv précalculée
+def snapshot_cursor(version):
+    return f"snap{version}"
 
-    start = datetime.datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-    end = start + datetime.timedelta(minutes=duration)
+def build_rdv_snapshot(version):
+    # Créneaux libres des PRECOMPUTE_DAYS prochains jours, et toutes les pages Block Kit déjà construites
+    today = datetime.datetime.now(timezone).date()
+    first, last = today.isoformat(), (today + datetime.timedelta(days=PRECOMPUTE_DAYS)).isoformat()
+    slots = tuple(s for s in available_slots(clients.calendar()) if first <= s[1] < last)
+    cursor_id = snapshot_cursor(version)
+    # Les anciens messages gardent leur pagination après le remplacement de l'instantané
+    slot_cursors.set(cursor_id, slots)
+    pages = max(1, -(-len(slots) // RDV_PAGE_SIZE))
+    return Snapshot(version, time.time(), slots, tuple(render_slot_page(cursor_id, slots, n) for n in range(pages)),
+                    build_free_slot_index(clients.calendar()))
+
+# -- Listes déroulantes external_select (modals /dispos et rdv_submit)
+def build_free_slot_index(service):
+    # Créneaux réellement libres (règles /dispos moins l'agenda) des PRECOMPUTE_DAYS prochains jours
+    now = datetime.datetime.now(timezone)
+    last = now + datetime.timedelta(days=PRECOMPUTE_DAYS)
+    weeks = -(-PRECOMPUTE_DAYS // 7)
+    return SlotIndex((start, end) for start, end in get_free_slots(service, weeks=weeks) if now < start < last)
+
+def free_slot_index():
+    # Index de l'instantané précalculé s'il est récent, sinon construit à la demande et gardé CACHE_TTL secondes
+    snapshot = fresh_snapshot()
+    if snapshot is not None:
+        return snapshot.index
+    return cache.get_or_load("slot_index", lambda: build_free_slot_index(clients.calendar()))
+
+RULE_TIMES = TimeGrid("07:00", "21:00", step=15)  # Heures proposées pour les règles /dispos
+
+def slot_options(callback_id, query):
+    if callback_id == "rdv_submit":
+        return free_slot_index().search(query)
+    return RULE_TIMES.search(query)
+
+precomputer = Precomputer(build_rdv_snapshot, interval=PRECOMPUTE_INTERVAL or 60)
+metrics.registry.gauge("planning_snapshot_age_seconds", precomputer.age)
+
+def fresh_snapshot():
+    # Instantané précalculé, None s'il date de plus de trois intervalles (précalcul arrêté ou Google indisponible)
+    return precomputer.current(max_age=3 * PRECOMPUTE_INTERVAL) if PRECOMPUTE_INTERVAL else None
+
+def parse_availability_submission(values):
+    jour = values["day_block"]["day"]["selected_option"]["value"]
+    heure_debut = values["start_time_block"]["start_time_input"]["selected_option"]["value"]
+    heure_fin = values["end_time_block"]["end_time_input"]["selected_option"]["value"]
+    duree = values["duration_block"]["duration"]["value"]
+    actif = values["active_block"]["active"]["selected_option"]["value"]
+    return jour, heure_debut, heure_fin, duree, actif
+
+def save_availability(jour, heure_debut, heure_fin, duree, actif):
+    # Saisie validée avant toute écriture, puis une seule écriture batchUpdate pour toute la ligne.
+    # Verrou partagé entre workers : les nouvelles lignes attribuées sont tenues dans le coordinateur (un autre
+    # worker a pu en ajouter une juste avant, sans que sa diffusion soit arrivée), sans relire la Sheet.
+    with coordinator.lock("rules"):
+        index = load_rule_index()
+        shared = coordinator.get_value("rules:rows") or {}
+        allocated = {int(weekday): row for weekday, row in shared.get("days", {}).items()}
+        try:
+            rule, created = index.prepare(jour, heure_debut, heure_fin, duree, actif,
+                                          allocated=allocated, next_row=shared.get("next_row", 0))
+        except slotgen.RuleError as e:
+            return f"❌ Disponibilités non modifiées : {e}"
+        row = rule.row
+        if created:
+            # Nouvelle ligne pour ce jour
+            change = {"range": f"A{row}:E{row}", "values": [[jour, heure_debut, heure_fin, duree, actif]]}
+        else:
+            change = {"range": f"B{row}:E{row}", "values": [[heure_debut, heure_fin, duree, actif]]}
+        try:
+            sheet_writer.write(rules_sheet(), [change]).result()
+        except Exception:
+            cache.invalidate("rule_index")
+            raise
+        # L'index en mémoire est mis à jour sur place, et reste celui du cache même si une invalidation
+        # (diffusion d'un autre worker) est arrivée entre-temps
+        index.apply(rule)
+        cache.set("rule_index", index, ttl=RULES_CACHE_TTL)
+        if created:
+            allocated[rule.weekday] = row
+            coordinator.set_value("rules:rows", {"next_row": index.next_row, "days": allocated}, ttl=RULES_CACHE_TTL)
+    cache.invalidate("slot_index")
+    precomputer.notify()
+    broadcast("rules", rule=[row, jour, heure_debut, heure_fin, duree, actif])
+    return f"✅ Créneaux mis à jour pour *{jour}* : {heure_debut} → {heure_fin} ({duree}min) / Actif : {actif}"
+
+# -- Vue du modal /dispos (construite une fois ; les heures sont servies par le handler d'options)
+def time_select(action_id, placeholder):
+    return {
+        "type": "external_select",
+        "action_id": action_id,
+        "placeholder": {"type": "plain_text", "text": placeholder},
+        "min_query_length": 0,
+    }
+
+AVAILABILITY_MODAL = {
+    "type": "modal",
+    "callback_id": "update_availability",
+    "title": {"type": "plain_text", "text": "Modifier mes créneaux"},
+    "submit": {"type": "plain_text", "text": "Mettre à jour"},
+    "blocks": [
+        {
+            "type": "input",
+            "block_id": "day_block",
+            "element": {
+                "type": "static_select",
+                "action_id": "day",
+                "placeholder": {"type": "plain_text", "text": "Jour"},
+                "options": [
+                    {"text": {"type": "plain_text", "text": j}, "value": j}
+                    for j in ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
+                ],
+            },
+            "label": {"type": "plain_text", "text": "Jour de la semaine"},
+        },
+        {
+            "type": "input",
+            "block_id": "start_time_block",
+            "label": {"type": "plain_text", "text": "Heure de début"},
+            "element": time_select("start_time_input", "Tape une heure (ex : 9, 14:30)"),
+        },
+        {
+            "type": "input",
+            "block_id": "end_time_block",
+            "label": {"type": "plain_text", "text": "Heure de fin"},
+            "element": time_select("end_time_input", "Tape une heure (ex : 12, 18:00)"),
+        },
+        {
+            "type": "input",
+            "block_id": "duration_block",
+            "element": {
+                "type": "plain_text_input",
+                "action_id": "duration",
+                "placeholder": {"type": "plain_text", "text": "ex: 30"},
+            },
+            "label": {"type": "plain_text", "text": "Durée des créneaux (en minutes)"},
+        },
+        {
+            "type": "input",
+            "block_id": "active_block",
+            "element": {
+                "type": "static_select",
+                "action_id": "active",
+                "options": [
+                    {"text": {"type": "plain_text", "text": "Oui"}, "value": "oui"},
+                    {"text": {"type": "plain_text", "text": "Non"}, "value": "non"},
+                ],
+            },
+            "label": {"type": "plain_text", "text": "Activer ?"},
+        },
+    ],
+}
+
+def availability_modal_view():
+    return AVAILABILITY_MODAL
+
+
+# -------- RÉPONSES (exécutées par les workers) --------
+BUSY_TEXT = "🚦 Trop de demandes en cours, réessaie dans quelques secondes."
+
+def book_meeting_reply(user, value, slack_id=None):
+    start, end = parse_meeting_value(value)
+    if book_event(get_calendar_service(), f"Rendez-vous avec {user}", start, end, user, slack_id) is None:
+        return "❌ Ce créneau est déjà réservé."
+    return f"✅ Rendez-vous réservé : {start.strftime('%H:%M')} → {end.strftime('%H:%M')}"
 
-    start_iso = start.isoformat()
-    end_iso = end.isoformat()
+def rdv_reply():
+    cursor_id, total = open_slot_cursor(clients.calendar())
+    if not total:
+        return "Aucun créneau disponible.", None
+    return "Voici les créneaux disponibles :", slot_page_blocks(cursor_id, 0)
+
+def book_slot_reply(user, value, slack_id=None):
+    row_idx, date_str, time_str, duration, start, end = parse_slot_value(value)
 
     # Vérifie disponibilité
-    events = calendar_service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=start.isoformat() + "Z",
-        timeMax=end.isoformat() + "Z",
-        singleEvents=True
-    ).execute()
-    if events.get("items"):
-        client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà réservé.")
-        return
+    if not is_slot_free(clients.calendar(), start, end):
+        return "❌ Ce créneau est déjà réservé."
 
     # Réserve dans Calendar
-    calendar_service.events().insert(calendarId=CALENDAR_ID, body={
-        "summary": f"RDV avec {user}",
-        "start": {"dateTime": start_iso, "timeZone": TIMEZONE},
-        "end": {"dateTime": end_iso, "timeZone": TIMEZONE},
-        "reminders": {
-            "useDefault": False,
-            "overrides": [
-                {"method": "email", "minutes": 24 * 60},  # 1 jour avant
-                {"method": "popup", "minutes": 60}  # 1 heure avant
-            ]
-        }
-    }).execute()
+    if book_event(clients.calendar(), f"RDV avec {user}", start, end, user, slack_id) is None:
+        return "❌ Ce créneau est déjà réservé."
 
     # Marque comme réservé dans la Sheet
-    sheet.update_cell(row_idx + 2, 4, "❌")  # ligne +2 (en-tête + index 0)
+    mark_slot_booked(row_idx)
+    return f"✅ Rendez-vous confirmé : {date_str} à {time_str} pour {duration} min."
 
-    # Confirmation
-    client.chat_postMessage(channel=body["user"]["id"],
-                            text=f"✅ Rendez-vous confirmé : {date_str} à {time_str} pour {duration} min.")
+def rdv_submit_reply(user, values, slack_id=None):
+    start_hour, duration_min, subject, start_dt, end_dt = parse_rdv_submission(values)
 
-@app.view("rdv_submit")
-def handle_submission(ack, body, view, logger, client):
+    # 🔍 Vérifier si un événement existe déjà
+    if not is_slot_free(clients.calendar(), start_dt, end_dt):
+        return "❌ Ce créneau est déjà occupé."
+
+    # ✅ Créer l'événement dans Calendar
+    if book_event(clients.calendar(), f"{subject} - {user}", start_dt, end_dt, user, slack_id) is None:
+        return "❌ Ce créneau est déjà occupé."
+
+    # 🧾 Ajouter à Google Sheet
+    append_booking_row(start_dt.date(), start_hour, duration_min, subject, user)
+    return f"✅ RDV confirmé le {start_dt.strftime('%d/%m')} à {start_hour} pour {duration_min} min."
+
+def common_slot_reply(slack_id, text):
+    # "/creneau-commun alice conseil 60" : consultants et/ou équipes, durée en minutes (30 par défaut)
+    names = text.split()
+    duration = 30
+    if names and names[-1].isdigit():
+        duration = int(names.pop())
+    requester = directory.for_slack_user(slack_id)
+    if requester:
+        names.append(requester.name)
+    try:
+        resources = directory.resolve(names)
+    except KeyError as e:
+        return f"❌ Consultant ou équipe inconnu : {e.args[0]}"
+    if not resources:
+        return "Usage : /creneau-commun <consultant|équipe> … [durée en minutes]"
+
+    now = datetime.datetime.now(timezone)
+    slot = teams.common_free_slot(availability, clients.calendar(), resources, datetime.timedelta(minutes=duration),
+                                  now, now + datetime.timedelta(weeks=SLOT_HORIZON_WEEKS))
+    who = ", ".join(r.name for r in resources)
+    if slot is None:
+        return f"Aucun créneau commun de {duration} min pour {who} sur les {SLOT_HORIZON_WEEKS} prochaines semaines."
+    start, end = (dt.astimezone(timezone) for dt in slot)
+    return f"📅 Premier créneau commun pour {who} : {start.strftime('%Y-%m-%d %H:%M')} → {end.strftime('%H:%M')}"
+
+def stats_reply(user):
+    # Compteurs tenus à jour par le journal : seules les réservations ajoutées depuis la dernière lecture sont lues
+    if booking_log is None:
+        return "📊 Journal des réservations désactivé (BOOKING_LOG)."
+    stats = booking_log.stats()
+    if not stats.total:
+        return "📊 Aucune réservation enregistrée pour l'instant."
+    lines = [f"📊 {stats.total} rendez-vous ({stats.minutes // 60} h {stats.minutes % 60:02d}) du {stats.first} au {stats.last}",
+             f"• Toi : {stats.by_user.get(user, 0)} rendez-vous",
+             "• Plus actifs : " + ", ".join(f"{name} ({count})" for name, count in stats.by_user.most_common(5))]
+    busiest = []
+    for key, count in stats.by_slot.most_common(3):
+        weekday, hour = key.split("-")
+        busiest.append(f"{DAY_NAMES[int(weekday)]} {int(hour)} h ({count})")
+    lines.append("• Créneaux les plus demandés : " + ", ".join(busiest))
+    usage = [f"{DAY_NAMES[n]} {rate:.0%}" for n, rate in enumerate(stats.utilization(load_rule_index().windows))
+             if rate is not None]
+    if usage:
+        lines.append("• Remplissage des disponibilités /dispos : " + ", ".join(usage))
+    return "\n".join(lines)
+
+def defer(client, channel, key, placeholder, reply, *args):
+    # Message d'attente posté tout de suite, remplacé par le résultat (chat_update) quand un worker a fini.
+    # Les travaux d'un même utilisateur sont traités dans l'ordre.
+    message = client.chat_postMessage(channel=channel, text=placeholder)
+
+    def run():
+        try:
+            result = reply(*args)
+        except googleapi.CircuitOpen:
+            client.chat_update(channel=message["channel"], ts=message["ts"],
+                               text="⚠️ Google Agenda / Sheets est indisponible pour le moment, réessaie dans quelques minutes.")
+            return
+        except Exception:
+            client.chat_update(channel=message["channel"], ts=message["ts"],
+                               text="⚠️ Une erreur est survenue, réessaie plus tard.")
+            raise
+        text, blocks = result if isinstance(result, tuple) else (result, None)
+        client.chat_update(channel=message["channel"], ts=message["ts"], text=text, blocks=blocks or [])
+
+    try:
+        jobs.submit(key, run)
+    except QueueFull:
+        client.chat_update(channel=message["channel"], ts=message["ts"], text=BUSY_TEXT)
+
+
+# -------- BOT SLACK --------
+
+@app.action("book_meeting")
+@metrics.listener("book_meeting")
+def handle_book_meeting(ack, body, respond):
     ack()
-    user = body["user"]["username"]
-    values = view["state"]["values"]
+    # Réponse via response_url : pas de message d'attente à mettre à jour, le résultat arrive directement
+    try:
+        jobs.submit(body["user"]["id"], lambda: respond(book_meeting_reply(body["user"]["username"],
+                                                                           body["actions"][0]["value"],
+                                                                           body["user"]["id"])))
+    except QueueFull:
+        respond(BUSY_TEXT)
 
-    start_hour = values["start_time_block"]["start_time_input"]["selected_option"]["value"]
-    duration_min = int(values["duration_block"]["duration_input"]["selected_option"]["value"])
-    subject = values["subject_block"]["subject_input"]["value"]
 
-    now = datetime.datetime.now()
-    start_dt = datetime.datetime.combine(now.date(), datetime.datetime.strptime(start_hour, "%H:%M").time())
-    end_dt = start_dt + datetime.timedelta(minutes=duration_min)
+@app.command("/dispos")
+@metrics.listener("dispos")
+def open_availability_modal(ack, body, client):
+    ack()
+    client.views_open(trigger_id=body["trigger_id"], view=availability_modal_view())
 
-    start_str = start_dt.isoformat()
-    end_str = end_dt.isoformat()
 
-    # 🔍 Vérifier si un événement existe déjà
-    events = calendar_service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=start_str,
-        timeMax=end_str,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    
-
-    if events.get("items"):
-        client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà occupé.")
+@app.view("update_availability")
+@metrics.listener("update_availability")
+def handle_availability_submission(ack, body, view, respond):
+    ack()
+    submission = parse_availability_submission(view["state"]["values"])
+    try:
+        jobs.submit(body["user"]["id"], lambda: respond(save_availability(*submission)))
+    except QueueFull:
+        respond(BUSY_TEXT)
+
+
+# Options des listes external_select : recherche par préfixe en mémoire, aucun appel Google
+@app.options(re.compile(r"^(start|end)_time_input$"))
+@metrics.listener("slot_options")
+def handle_slot_options(ack, body):
+    ack(options=slot_options(body["view"]["callback_id"], body.get("value", "")))
+
+
+# Commande Slack : /rdv
+@app.command("/rdv")
+@metrics.listener("rdv")
+def handle_rdv(ack, body, client):
+    ack()
+    # Instantané récent : la réponse est déjà construite, aucun appel Google
+    snapshot = fresh_snapshot()
+    if snapshot is not None:
+        if not snapshot.slots:
+            client.chat_postMessage(channel=body["user_id"], text="Aucun créneau disponible.")
+        else:
+            client.chat_postMessage(channel=body["user_id"], text="Voici les créneaux disponibles :",
+                                    blocks=snapshot.pages[0])
         return
+    defer(client, body["user_id"], body["user_id"], "⏳ Recherche des créneaux disponibles…", rdv_reply)
 
-    # ✅ Créer l'événement dans Calendar
-    event = {
-        "summary": f"{subject} - {user}",
-        "start": {"dateTime": start_str, "timeZone": TIMEZONE},
-        "end": {"dateTime": end_str, "timeZone": TIMEZONE},
-        "reminders": {
-            "useDefault": False,
-            "overrides": [
-                {"method": "email", "minutes": 24 * 60},  # 1 jour avant
-                {"method": "popup", "minutes": 60}  # 1 heure avant
-            ]
-        }
-    }
-    calendar_service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+# Pagination de /rdv : met à jour le même message
+@app.action(re.compile(r"^rdv_page_(prev|next)$"))
+@metrics.listener("rdv_page")
+def handle_rdv_page(ack, body, client):
+    ack()
+    cursor_id, page = parse_page_value(body["actions"][0]["value"])
+    blocks = slot_page_blocks(cursor_id, page)
+    if blocks is None:
+        client.chat_update(channel=body["channel"]["id"], ts=body["message"]["ts"],
+                           text="⌛ Cette liste a expiré, relance /rdv.", blocks=[])
+        return
+    client.chat_update(channel=body["channel"]["id"], ts=body["message"]["ts"],
+                       text="Voici les créneaux disponibles :", blocks=blocks)
 
-    # 🧾 Ajouter à Google Sheet
-    sheet.append_row([str(now.date()), start_hour, f"{duration_min} min", subject, user])
+@app.action("book_slot")
+@metrics.listener("book_slot")
+def handle_book_slot(ack, body, client):
+    ack()
+    defer(client, body["user"]["id"], body["user"]["id"], "⏳ Réservation en cours…",
+          book_slot_reply, body["user"]["username"], body["actions"][0]["value"], body["user"]["id"])
 
-    # ✅ Confirmer
-    client.chat_postMessage(channel=body["user"]["id"], text=f"✅ RDV confirmé à {start_hour} pour {duration_min} min.")
+@app.view("rdv_submit")
+@metrics.listener("rdv_submit")
+def handle_rdv_submit(ack, body, view, logger, client):
+    ack()
+    defer(client, body["user"]["id"], body["user"]["id"], "⏳ Création du rendez-vous…",
+          rdv_submit_reply, body["user"]["username"], view["state"]["values"], body["user"]["id"])
 
+# Réservation groupée ou récurrente
+@app.command("/rdv-serie")
+@metrics.listener("rdv_serie")
+def handle_bulk_booking(ack, body, client):
+    ack()
+    defer(client, body["user_id"], body["user_id"], "⏳ Réservation de la série…",
+          bulk_reply, body["user_name"], body.get("text", ""), body["user_id"])
 
-# Interactivité bouton
-@app.action("book_meeting")
-def handle_booking(ack, body, respond):
+# Premier créneau libre commun à plusieurs consultants / équipes
+@app.command("/creneau-commun")
+@metrics.listener("creneau_commun")
+def handle_common_slot(ack, body, client):
     ack()
-    user = body['user']['username']
-    value = body['actions'][0]['value']
-    start, end = value.split('|')
+    defer(client, body["user_id"], body["user_id"], "⏳ Recherche d'un créneau commun…",
+          common_slot_reply, body["user_id"], body.get("text", ""))
 
-    service = get_calendar_service()
 
-    event = {
-        'summary': f'Rendez-vous avec {user}',
-        'start': {'dateTime': start, 'timeZone': 'Europe/Paris'},
-        'end': {'dateTime': end, 'timeZone': 'Europe/Paris'},
-        'reminders': {
-            'useDefault': False,
-            'overrides': [
-                {'method': 'email', 'minutes': 24 * 60},  # 1 jour avant
-                {'method': 'popup', 'minutes': 60}  # 1 heure avant
-            ]
-        }
-    }
+# Statistiques d'usage
+@app.command("/rdv-stats")
+@metrics.listener("rdv_stats")
+def handle_stats(ack, body, client):
+    ack()
+    defer(client, body["user_id"], body["user_id"], "⏳ Calcul des statistiques…", stats_reply, body["user_name"])
+
+
+def warm_up():
+    # Ouvre les connexions à l'avance pour que la première commande ne paie pas l'initialisation
+    timings = {}
+    for name, step in [
+        ("slack", lambda: app.client.auth_test()),
+        ("credentials", clients.credentials),
+        ("calendar", clients.calendar),
+        ("slots", store.available_rows),
+        ("rules", load_rule_index),
+    ]:
+        t = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"⚠️ Préchauffage {name} en échec : {e}")
+        timings[name] = time.perf_counter() - t
+    print("Préchauffage terminé : " + ", ".join(f"{name} {d * 1000:.0f} ms" for name, d in timings.items()))
 
-    service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-    
-    print("response agenda :", t)
+def startup_report(stage):
+    print(f"⏱️ {stage} : {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms après le démarrage")
 
-    respond(f"✅ Rendez-vous réservé de {start[11:16]} à {end[11:16]}")
+webhook_server = None
+
+def start_leader_jobs():
+    # Tâches à instance unique : réplication vers la Sheet et récepteur des notifications Calendar
+    global webhook_server
+    print("👑 Worker élu leader, démarrage des tâches de fond partagées")
+    if replicator:
+        replicator.start()  # Inactif quand ce worker n'est plus leader (active=leadership.is_leader)
+    if CALENDAR_SYNC_INTERVAL > 0 and CALENDAR_WEBHOOK_PORT and webhook_server is None:
+        if not CALENDAR_WEBHOOK_TOKEN:
+            print("⚠️ Récepteur des notifications Calendar non démarré : CALENDAR_WEBHOOK_TOKEN manquant")
+        else:
+            webhook_server = calendar_sync.serve_webhook(CALENDAR_WEBHOOK_PORT, CALENDAR_WEBHOOK_TOKEN,
+                                                         host=CALENDAR_WEBHOOK_HOST)
+
+
+def stop_leader_jobs():
+    # Un autre worker est leader : le récepteur est arrêté et libère son port
+    global webhook_server
+    print("⚠️ Worker plus leader, arrêt du récepteur des notifications Calendar")
+    if webhook_server is not None:
+        webhook_server.shutdown()
+        webhook_server.server_close()
+        webhook_server = None
+
+def start_background_jobs():
+    # Tâches propres à chaque worker (caches et instantanés locaux), puis élection du leader
+    coordinator.subscribe("invalidate", on_broadcast)
+    if PRECOMPUTE_INTERVAL > 0:
+        precomputer.start()
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT, host=METRICS_HOST)
+        except OSError as e:
+            # Plusieurs workers sur la même machine : seul le premier expose /metrics
+            print(f"⚠️ Endpoint /metrics non démarré : {e}")
+    if CALENDAR_SYNC_INTERVAL > 0:
+        calendar_sync.start()
+    if REMINDER_OFFSETS:
+        # Chaque worker envoie les rappels échus de sa base ; un rappel est revendiqué avant l'envoi
+        reminders.start()
+    leadership.on_elected(start_leader_jobs)
+    leadership.on_demoted(stop_leader_jobs)
+    leadership.start()
 
 # Lancer le bot
 if __name__ == "__main__":
-    SocketModeHandler(app, SLACK_APP_TOKEN).start()
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
+    startup_report("Module chargé")
+    handler = SocketModeHandler(app, SLACK_APP_TOKEN)
+    handler.connect()
+    startup_report("Connecté à Slack, prêt")
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    start_background_jobs()
+    threading.Event().wait()
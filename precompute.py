@@ -0,0 +1,64 @@
+import collections
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Réponse /rdv prête à l'emploi (et index des créneaux libres des listes déroulantes) : instantané immuable, remplacé d'un bloc (affectation d'attribut atomique)
+Snapshot = collections.namedtuple("Snapshot", "version built_at slots pages index")
+
+
+class Precomputer:
+    # Recalcule l'instantané en arrière-plan : toutes les `interval` s, ou peu après un notify()
+    # (modification des règles, de la Sheet ou de l'agenda). Les handlers ne font qu'une lecture mémoire.
+
+    def __init__(self, compute, interval=60, debounce=1.0, name="precompute"):
+        self.compute = compute  # (version) -> Snapshot
+        self.interval = interval
+        self.debounce = debounce  # Regroupe les notifications rapprochées en un seul recalcul
+        self.name = name
+        self.snapshot = None
+        self._version = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def current(self, max_age=None):
+        # None si aucun instantané, ou s'il est trop ancien (daemon arrêté ou Google indisponible)
+        snapshot = self.snapshot
+        if snapshot is None or (max_age is not None and time.time() - snapshot.built_at > max_age):
+            return None
+        return snapshot
+
+    def age(self):
+        snapshot = self.snapshot
+        return time.time() - snapshot.built_at if snapshot else -1
+
+    def notify(self):
+        self._wake.set()
+
+    def refresh(self):
+        self._version += 1
+        with metrics.registry.timed("planning_precompute_seconds", job=self.name):
+            snapshot = self.compute(self._version)
+        self.snapshot = snapshot
+        return snapshot
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                metrics.registry.inc("planning_precompute_errors_total", job=self.name)
+                logger.exception("Précalcul %s en échec", self.name)
+            if self._wake.wait(self.interval):
+                time.sleep(self.debounce)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self._thread
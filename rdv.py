@@ -1,9 +1,14 @@
 import datetime
+import threading
+import time
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import gspread
+from clients import ClientRegistry
+import googleapi
+from freebusy import query_busy, overlaps
+from ledger import ReservationLedger
+from slotindex import SlotIndex
 
 # -- CONFIGURATION --
 SLACK_BOT_TOKEN = "xoxb-..."
@@ -12,72 +17,98 @@ CALENDAR_ID = "tonemail@gmail.com"
 SHEET_ID = "1a2B3cD4e5F6GhIjKlMnOpQrStUvWxYz"  # ID Google Sheet
 SERVICE_ACCOUNT_FILE = "service_account.json"
 TIMEZONE = "Europe/Paris"
+DB_PATH = "planning.db"
 
 # -- INIT GOOGLE APIs --
 SCOPES = ["https://www.googleapis.com/auth/calendar", "https://www.googleapis.com/auth/spreadsheets"]
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-calendar_service = build("calendar", "v3", credentials=creds)
-sheet_client = gspread.authorize(creds)
-sheet = sheet_client.open_by_key(SHEET_ID).sheet1
+ledger = ReservationLedger(DB_PATH)
+clients = ClientRegistry(lambda: service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES),
+                         request_builder=googleapi.request_builder, wrap_gspread=googleapi.wrap_gspread)
 
 # -- INIT SLACK APP --
 app = App(token=SLACK_BOT_TOKEN)
 
+# -- CRÉNEAUX LIBRES (listes déroulantes du modal) --
+SLOT_HOURS = range(9, 18)  # Débuts de créneau proposés (heures pleines)
+SLOT_DAYS = 7
+free_slots = SlotIndex([])
+
+def refresh_free_slots():
+    # Heures pleines des SLOT_DAYS prochains jours ouvrés moins les plages occupées (une requête freebusy)
+    global free_slots
+    now = datetime.datetime.now()
+    candidates = [(start, start + datetime.timedelta(hours=1))
+                  for day in (now.date() + datetime.timedelta(days=n) for n in range(SLOT_DAYS)) if day.weekday() < 5
+                  for start in (datetime.datetime.combine(day, datetime.time(h)) for h in SLOT_HOURS) if start > now]
+    if not candidates:
+        return
+    busy = query_busy(clients.calendar(), [CALENDAR_ID], candidates[0][0], candidates[-1][1])[CALENDAR_ID]
+    free_slots = SlotIndex([(s, e) for s, e in candidates if not overlaps(busy, s, e)])
+
+def refresh_loop(interval=60):
+    while True:
+        try:
+            refresh_free_slots()
+        except Exception as e:
+            print(f"⚠️ Mise à jour des créneaux libres en échec : {e}")
+        time.sleep(interval)
+
+# -- MODAL (construit une fois) --
+RDV_MODAL = {
+    "type": "modal",
+    "callback_id": "rdv_submit",
+    "title": {"type": "plain_text", "text": "Prendre un RDV"},
+    "submit": {"type": "plain_text", "text": "Confirmer"},
+    "close": {"type": "plain_text", "text": "Annuler"},
+    "blocks": [
+        {
+            "type": "input",
+            "block_id": "start_time_block",
+            "label": {"type": "plain_text", "text": "Créneau"},
+            "element": {
+                "type": "external_select",
+                "action_id": "start_time_input",
+                "placeholder": {"type": "plain_text", "text": "Tape un jour ou une heure (ex : mardi, 14:00)"},
+                "min_query_length": 0
+            }
+        },
+        {
+            "type": "input",
+            "block_id": "duration_block",
+            "label": {"type": "plain_text", "text": "Durée"},
+            "element": {
+                "type": "static_select",
+                "action_id": "duration_input",
+                "placeholder": {"type": "plain_text", "text": "Choisis la durée"},
+                "options": [
+                    {"text": {"type": "plain_text", "text": "30 min"}, "value": "30"},
+                    {"text": {"type": "plain_text", "text": "1h"}, "value": "60"},
+                    {"text": {"type": "plain_text", "text": "1h30"}, "value": "90"}
+                ]
+            }
+        },
+        {
+            "type": "input",
+            "block_id": "subject_block",
+            "label": {"type": "plain_text", "text": "Sujet"},
+            "element": {
+                "type": "plain_text_input",
+                "action_id": "subject_input",
+                "placeholder": {"type": "plain_text", "text": "Ex: entretien, démo..."}
+            }
+        }
+    ]
+}
+
 @app.command("/rdv")
 def open_modal(ack, body, client):
     ack()
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        view={
-            "type": "modal",
-            "callback_id": "rdv_submit",
-            "title": {"type": "plain_text", "text": "Prendre un RDV"},
-            "submit": {"type": "plain_text", "text": "Confirmer"},
-            "close": {"type": "plain_text", "text": "Annuler"},
-            "blocks": [
-                {
-                    "type": "input",
-                    "block_id": "start_time_block",
-                    "label": {"type": "plain_text", "text": "Heure de début"},
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "start_time_input",
-                        "placeholder": {"type": "plain_text", "text": "Choisis une heure"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": f"{h:02d}:00"}, "value": f"{h:02d}:00"}
-                            for h in range(9, 18)
-                        ]
-                    }
-                },
-                {
-                    "type": "input",
-                    "block_id": "duration_block",
-                    "label": {"type": "plain_text", "text": "Durée"},
-                    "element": {
-                        "type": "static_select",
-                        "action_id": "duration_input",
-                        "placeholder": {"type": "plain_text", "text": "Choisis la durée"},
-                        "options": [
-                            {"text": {"type": "plain_text", "text": "30 min"}, "value": "30"},
-                            {"text": {"type": "plain_text", "text": "1h"}, "value": "60"},
-                            {"text": {"type": "plain_text", "text": "1h30"}, "value": "90"}
-                        ]
-                    }
-                },
-                {
-                    "type": "input",
-                    "block_id": "subject_block",
-                    "label": {"type": "plain_text", "text": "Sujet"},
-                    "element": {
-                        "type": "plain_text_input",
-                        "action_id": "subject_input",
-                        "placeholder": {"type": "plain_text", "text": "Ex: entretien, démo..."}
-                    }
-                }
-            ]
-        }
-    )
+    client.views_open(trigger_id=body["trigger_id"], view=RDV_MODAL)
+
+@app.options("start_time_input")
+def slot_options(ack, body):
+    # Recherche dans l'index en mémoire, sans appel Google
+    ack(options=free_slots.search(body.get("value", "")))
 
 @app.view("rdv_submit")
 def handle_submission(ack, body, view, logger, client):
@@ -85,44 +116,50 @@ def handle_submission(ack, body, view, logger, client):
     user = body["user"]["username"]
     values = view["state"]["values"]
 
-    start_hour = values["start_time_block"]["start_time_input"]["selected_option"]["value"]
+    start_dt = datetime.datetime.fromisoformat(values["start_time_block"]["start_time_input"]["selected_option"]["value"])
     duration_min = int(values["duration_block"]["duration_input"]["selected_option"]["value"])
     subject = values["subject_block"]["subject_input"]["value"]
-
-    now = datetime.datetime.now()
-    start_dt = datetime.datetime.combine(now.date(), datetime.datetime.strptime(start_hour, "%H:%M").time())
+    start_hour = start_dt.strftime("%H:%M")
     end_dt = start_dt + datetime.timedelta(minutes=duration_min)
 
     start_str = start_dt.isoformat()
     end_str = end_dt.isoformat()
 
     # 🔍 Vérifier si un événement existe déjà
-    events = calendar_service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=start_str,
-        timeMax=end_str,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-
-    if events.get("items"):
+    calendar_service = clients.calendar()
+    busy = query_busy(calendar_service, [CALENDAR_ID], start_dt, end_dt)[CALENDAR_ID]
+    if overlaps(busy, start_dt, end_dt):
+        client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà occupé.")
+        return
+
+    # 🔒 Revendiquer le créneau avant l'insertion (pas de double réservation sur clics simultanés)
+    event_id = ledger.claim(CALENDAR_ID, start_dt, end_dt, user)
+    if event_id is None:
         client.chat_postMessage(channel=body["user"]["id"], text="❌ Ce créneau est déjà occupé.")
         return
 
-    # ✅ Créer l'événement dans Calendar
+    # ✅ Créer l'événement dans Calendar (id déterministe : un réessai ne crée pas de doublon)
     event = {
+        "id": event_id,
         "summary": f"{subject} - {user}",
         "start": {"dateTime": start_str, "timeZone": TIMEZONE},
         "end": {"dateTime": end_str, "timeZone": TIMEZONE},
     }
-    calendar_service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+    try:
+        calendar_service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+    except Exception:
+        ledger.release(CALENDAR_ID, start_dt)
+        raise
+    ledger.confirm(CALENDAR_ID, start_dt)
+    refresh_free_slots()
 
     # 🧾 Ajouter à Google Sheet
-    sheet.append_row([str(now.date()), start_hour, f"{duration_min} min", subject, user])
+    clients.worksheet(key=SHEET_ID).append_row([str(start_dt.date()), start_hour, f"{duration_min} min", subject, user])
 
     # ✅ Confirmer
-    client.chat_postMessage(channel=body["user"]["id"], text=f"✅ RDV confirmé à {start_hour} pour {duration_min} min.")
+    client.chat_postMessage(channel=body["user"]["id"], text=f"✅ RDV confirmé le {start_dt.strftime('%d/%m')} à {start_hour} pour {duration_min} min.")
 
 # Lancement
 if __name__ == "__main__":
+    threading.Thread(target=refresh_loop, name="free-slots", daemon=True).start()
     SocketModeHandler(app, SLACK_APP_TOKEN).start()
@@ -0,0 +1,202 @@
+import heapq
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from googleapi import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5  # Envois en échec avant abandon d'un rappel
+RETRY_DELAY = 30  # Attente (s) avant un nouvel essai, hors limite de débit Slack (Retry-After)
+
+
+def _rate_limited(error):
+    # slack_sdk SlackApiError : 429 avec l'en-tête Retry-After ; renvoie le délai demandé, sinon None
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after") or 1
+    try:
+        return float(value[0] if isinstance(value, list) else value)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class ReminderScheduler:
+    # Rappels Slack persistés dans SQLite (ils survivent aux redémarrages) ; un tas en mémoire donne la prochaine
+    # échéance, un seul thread dort jusqu'à elle. Plusieurs processus peuvent partager la base : chaque rappel est
+    # revendiqué avant l'envoi, aucun n'est envoyé deux fois.
+
+    def __init__(self, path, send, rate=1.0, burst=5, refresh=30, claim_ttl=120, name="reminders"):
+        self.path = path
+        self.send = send  # send(channel, text), appelé dans le thread du planificateur
+        self.bucket = TokenBucket(rate, burst)  # Messages Slack par seconde (chat.postMessage : ~1 / s par canal)
+        self.refresh = refresh  # Relecture (s) des rappels ajoutés par d'autres processus
+        self.claim_ttl = claim_ttl  # Une revendication sans envoi (processus arrêté) expire après ce délai (s)
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._heap = []  # (échéance, id) ; la base fait foi, une entrée supprimée entre-temps est ignorée
+        self._known = set()
+        self._last_id = 0
+        self._wake = threading.Condition()
+        self._local = threading.local()
+        self._thread = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    due REAL NOT NULL,
+                    expires REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_by TEXT,
+                    claimed_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS reminders_key ON reminders (key);
+            """)
+            self._local.conn = conn
+        return conn
+
+    def schedule(self, key, channel, due, text, expires=None):
+        # key : identifiant de la réservation (cancel) ; due / expires en secondes epoch.
+        # Un rappel dont l'échéance est passée de plus de `expires` n'est plus envoyé (bot arrêté trop longtemps).
+        expires = expires if expires is not None else due + 3600
+        cur = self._conn().execute(
+            "INSERT INTO reminders (key, channel, text, due, expires) VALUES (?, ?, ?, ?, ?)",
+            (key, channel, text, due, expires))
+        self._push(due, cur.lastrowid)
+        return cur.lastrowid
+
+    def cancel(self, key):
+        # Les entrées du tas restent, elles sont écartées à l'échéance (plus de ligne en base)
+        return self._conn().execute("DELETE FROM reminders WHERE key = ?", (key,)).rowcount
+
+    def pending(self):
+        return len(self._heap)
+
+    def _push(self, due, reminder_id):
+        with self._wake:
+            if reminder_id in self._known:
+                return
+            self._known.add(reminder_id)
+            heapq.heappush(self._heap, (due, reminder_id))
+            self._wake.notify()
+
+    def _load(self):
+        # Nouveaux rappels (autres processus), et rappels revendiqués par un processus arrêté avant l'envoi
+        rows = self._conn().execute(
+            "SELECT id, due FROM reminders WHERE id > ? OR claimed_at < ? ORDER BY id",
+            (self._last_id, time.time() - self.claim_ttl)).fetchall()
+        for reminder_id, due in rows:
+            self._push(due, reminder_id)
+            self._last_id = max(self._last_id, reminder_id)
+
+    def _pop_due(self):
+        now = time.time()
+        due = []
+        with self._wake:
+            while self._heap and self._heap[0][0] <= now:
+                _, reminder_id = heapq.heappop(self._heap)
+                self._known.discard(reminder_id)
+                due.append(reminder_id)
+        return due
+
+    def _claim(self, ids):
+        now = time.time()
+        conn = self._conn()
+        claimed = []
+        for reminder_id in ids:
+            if conn.execute(
+                    "UPDATE reminders SET claimed_by = ?, claimed_at = ? "
+                    "WHERE id = ? AND (claimed_by IS NULL OR claimed_at < ?)",
+                    (self.owner, now, reminder_id, now - self.claim_ttl)).rowcount:
+                claimed.append(conn.execute("SELECT id, channel, text, expires, attempts FROM reminders WHERE id = ?",
+                                            (reminder_id,)).fetchone())
+        return claimed
+
+    def _retry(self, items, delay, failed):
+        conn = self._conn()
+        for reminder_id, attempts in items:
+            if failed and attempts + 1 >= MAX_ATTEMPTS:
+                logger.error("Rappel %s abandonné après %d essais", reminder_id, attempts + 1)
+                conn.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
+                continue
+            due = time.time() + delay
+            conn.execute("UPDATE reminders SET due = ?, attempts = attempts + ?, claimed_by = NULL, claimed_at = NULL "
+                         "WHERE id = ?",
+                         (due, 1 if failed else 0, reminder_id))
+            self._push(due, reminder_id)
+
+    def _deliver(self, ids):
+        # Les rappels échus d'un même destinataire partent dans un seul message
+        now = time.time()
+        conn = self._conn()
+        by_channel = {}
+        for reminder_id, channel, text, expires, attempts in self._claim(ids):
+            if expires < now:
+                conn.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
+                metrics.registry.inc("planning_reminders_expired_total", job=self.name)
+                continue
+            by_channel.setdefault(channel, []).append((reminder_id, text, attempts))
+
+        channels = list(by_channel.items())
+        for n, (channel, items) in enumerate(channels):
+            self.bucket.take()
+            try:
+                self.send(channel, "\n".join(text for _, text, _ in items))
+            except Exception as e:
+                retry_after = _rate_limited(e)
+                if retry_after is not None:
+                    # Limite Slack atteinte : ce message et les suivants sont repoussés d'autant
+                    metrics.registry.inc("planning_reminders_rate_limited_total", job=self.name)
+                    pending = [(i, a) for _, rest in channels[n:] for i, _, a in rest]
+                    self._retry(pending, retry_after, failed=False)
+                    return
+                logger.exception("Envoi d'un rappel à %s en échec", channel)
+                metrics.registry.inc("planning_reminders_errors_total", job=self.name)
+                self._retry([(i, a) for i, _, a in items], RETRY_DELAY, failed=True)
+                continue
+            conn.executemany("DELETE FROM reminders WHERE id = ?", [(i,) for i, _, _ in items])
+            metrics.registry.inc("planning_reminders_sent_total", value=len(items), job=self.name)
+
+    def _run(self):
+        next_load = 0
+        while True:
+            if time.time() >= next_load:
+                try:
+                    self._load()
+                except Exception:
+                    logger.exception("Lecture des rappels en échec")
+                next_load = time.time() + self.refresh
+            due = self._pop_due()
+            if due:
+                try:
+                    self._deliver(due)
+                except Exception:
+                    logger.exception("Envoi des rappels en échec")
+            with self._wake:
+                timeout = next_load - time.time()
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                if timeout > 0:
+                    self._wake.wait(timeout)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self._thread
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import Future
+
+
+class SheetWriter:
+    # Regroupe les écritures Sheets : toutes les modifications arrivées pendant `window` secondes
+    # partent dans un seul values.batchUpdate par feuille (écriture atomique côté Google)
+
+    def __init__(self, window=0.05, value_input_option="USER_ENTERED"):
+        self.window = window
+        self.value_input_option = value_input_option
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def write(self, worksheet, data):
+        # data : [{"range": "B2:E2", "values": [[...]]}, ...] ; renvoie un Future résolu après l'envoi
+        future = Future()
+        key = (worksheet.spreadsheet.id, worksheet.id)
+        with self._lock:
+            self._pending.setdefault(key, (worksheet, []))[1].append((data, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+
+        for worksheet, items in pending.values():
+            data = [change for changes, _ in items for change in changes]
+            try:
+                worksheet.batch_update(data, value_input_option=self.value_input_option)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+            else:
+                for _, future in items:
+                    future.set_result(len(data))
@@ -0,0 +1,65 @@
+import bisect
+
+# Recherche par préfixe pour les listes déroulantes Slack (external_select) : tout est calculé à la
+# construction, une requête d'options n'est qu'une bisection dans une liste triée, sans appel Google.
+
+MAX_OPTIONS = 100  # Limite Slack par réponse d'options
+DAY_NAMES = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+
+
+def option(text, value):
+    return {"text": {"type": "plain_text", "text": text}, "value": value}
+
+
+def prefix_range(keys, prefix):
+    # Tranche [lo, hi) des clés triées commençant par `prefix`
+    lo = bisect.bisect_left(keys, prefix)
+    return lo, bisect.bisect_left(keys, prefix + "\uffff", lo)
+
+
+class TimeGrid:
+    # Heures de la journée par pas de `step` minutes ("09:00", "09:15"…) : déjà triées, donc cherchables telles quelles
+    def __init__(self, first="07:00", last="21:00", step=15):
+        h, m = map(int, first.split(":"))
+        end_h, end_m = map(int, last.split(":"))
+        self.times = [f"{t // 60:02d}:{t % 60:02d}" for t in range(h * 60 + m, end_h * 60 + end_m + 1, step)]
+        self._options = [option(t, t) for t in self.times]
+
+    def search(self, query, limit=MAX_OPTIONS):
+        query = query.strip().replace("h", ":")
+        if query[:1].isdigit() and query[1:2] in ("", ":"):
+            query = "0" + query  # "9" ou "9:30" → "09…"
+        lo, hi = prefix_range(self.times, query)
+        return self._options[lo:min(hi, lo + limit)]
+
+
+class SlotIndex:
+    # Créneaux libres (début, fin) triés par début, retrouvés par préfixe de n'importe quelle forme du libellé :
+    # "mardi 20/10 14:00", "mar 20/10", "20/10 14", "14:00", "2026-10-20"…
+    def __init__(self, slots):
+        self.slots = sorted(slots)
+        self._options = []
+        entries = []
+        for pos, (start, end) in enumerate(self.slots):
+            day, date, hour = DAY_NAMES[start.weekday()], start.strftime("%d/%m"), start.strftime("%H:%M")
+            minutes = int((end - start).total_seconds() // 60)
+            self._options.append(option(f"{day[:3].capitalize()} {date} {hour} ({minutes} min)",
+                                        start.strftime("%Y-%m-%dT%H:%M")))
+            for key in {f"{day} {date} {hour}", f"{day[:3]} {date} {hour}", f"{date} {hour}", hour,
+                        hour.lstrip("0"), start.strftime("%Y-%m-%d %H:%M")}:
+                entries.append((key, pos))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._positions = [pos for _, pos in entries]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def search(self, query, limit=MAX_OPTIONS):
+        # Options Slack des créneaux correspondants, dans l'ordre chronologique
+        query = " ".join(query.lower().split())
+        if not query:
+            return self._options[:limit]
+        lo, hi = prefix_range(self._keys, query)
+        positions = sorted(set(self._positions[lo:hi]))
+        return [self._options[pos] for pos in positions[:limit]]
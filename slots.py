@@ -0,0 +1,221 @@
+import bisect
+import datetime
+import threading
+from array import array
+
+import pytz
+
+from freebusy import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+# Noms de jours acceptés dans la Sheet (français du modal /dispos, anglais de strftime)
+WEEKDAYS = {
+    "lundi": 0, "mardi": 1, "mercredi": 2, "jeudi": 3, "vendredi": 4, "samedi": 5, "dimanche": 6,
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+}
+
+
+def weekday_index(day_name):
+    return WEEKDAYS.get(str(day_name).strip().lower())
+
+
+def parse_minutes(value):
+    hours, minutes = str(value).strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+# -- Règles de disponibilité (/dispos)
+COLUMNS = ["Jour", "Heure début", "Heure fin", "Durée créneau (min)", "Actif"]
+
+
+class RuleError(ValueError):
+    pass
+
+
+class AvailabilityRule:
+    # Une ligne de la Sheet des disponibilités, validée et convertie en minutes depuis minuit
+    __slots__ = ("row", "day", "weekday", "start", "end", "duration", "active")
+
+    def __init__(self, row, day, weekday, start, end, duration, active):
+        self.row = row
+        self.day = day
+        self.weekday = weekday
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.active = active
+
+    @classmethod
+    def parse(cls, row, day, start, end, duration, active):
+        weekday = weekday_index(day)
+        if weekday is None:
+            raise RuleError(f"ligne {row} : jour inconnu « {day} »")
+        try:
+            start_min, end_min = parse_minutes(start), parse_minutes(end)
+        except ValueError:
+            raise RuleError(f"ligne {row} : heure mal formée « {start} » / « {end} »")
+        try:
+            duration_min = int(duration)
+        except (TypeError, ValueError):
+            raise RuleError(f"ligne {row} : Durée créneau (min) invalide « {duration} »")
+        if duration_min <= 0:
+            raise RuleError(f"ligne {row} : Durée créneau (min) doit être positive")
+        if end_min <= start_min:
+            raise RuleError(f"ligne {row} : l'heure de fin {end} précède l'heure de début {start}")
+        return cls(row, str(day).strip(), weekday, start_min, end_min, duration_min,
+                   str(active).strip().lower() == "oui")
+
+    def window(self):
+        return self.start, self.end, self.duration
+
+
+class RuleIndex:
+    # Règles indexées par jour de semaine (tableau de 7 listes), construites une fois depuis la Sheet.
+    # Les lignes invalides sont écartées et listées dans `errors` ; /dispos met l'index à jour sur place.
+
+    def __init__(self, rules, next_row, errors=()):
+        self.next_row = next_row
+        self.errors = list(errors)
+        self._lock = threading.Lock()
+        self._reserved = {}  # jour de semaine -> ligne réservée par prepare() et pas encore appliquée
+        self.by_weekday = [[] for _ in range(7)]  # Règles de chaque jour, triées par ligne de la Sheet
+        for rule in sorted(rules, key=lambda r: r.row):
+            self.by_weekday[rule.weekday].append(rule)
+        self.windows = [[] for _ in range(7)]  # Fenêtres actives (début, fin, durée) par jour, pour expand()
+        for weekday in range(7):
+            self._reindex(weekday)
+
+    @classmethod
+    def build(cls, values):
+        # values : get_all_values() de la Sheet, ligne 1 = en-tête
+        header = [str(h).strip() for h in values[0]] if values else COLUMNS
+        columns = [header.index(name) if name in header else None for name in COLUMNS]
+        rules, errors = [], []
+        for row, line in enumerate(values[1:], start=2):
+            cells = [line[i] if i is not None and i < len(line) else "" for i in columns]
+            if not any(str(c).strip() for c in cells):
+                continue
+            try:
+                rules.append(AvailabilityRule.parse(row, *cells))
+            except RuleError as e:
+                errors.append(str(e))
+        return cls(rules, max(len(values), 1) + 1, errors)
+
+    @property
+    def rules(self):
+        return sorted((r for rules in self.by_weekday for r in rules), key=lambda r: r.row)
+
+    def _reindex(self, weekday):
+        self.windows[weekday] = [r.window() for r in self.by_weekday[weekday] if r.active]
+
+    def rule_for(self, weekday):
+        # Première ligne de la Sheet pour ce jour (celle que /dispos modifie)
+        rules = self.by_weekday[weekday]
+        return rules[0] if rules else None
+
+    def prepare(self, day, start, end, duration, active, allocated=None, next_row=0):
+        # Valide une saisie /dispos (RuleError sinon) et renvoie (règle, créée).
+        # Une nouvelle ligne est réservée tout de suite pour que deux saisies simultanées n'écrivent pas au même endroit.
+        # allocated (jour de semaine -> ligne) / next_row : lignes déjà attribuées par d'autres workers, dont la
+        # diffusion n'est peut-être pas encore arrivée ici
+        allocated = allocated or {}
+        with self._lock:
+            weekday = weekday_index(day)
+            existing = self.rule_for(weekday) if weekday is not None else None
+            if existing:
+                row = existing.row
+            elif weekday in allocated:
+                row = allocated[weekday]
+            else:
+                row = self._reserved.get(weekday, max(self.next_row, next_row))
+            rule = AvailabilityRule.parse(row, day, start, end, duration, active)
+            if existing is None and weekday not in allocated and weekday not in self._reserved:
+                self._reserved[weekday] = row
+                self.next_row = row + 1
+            return rule, existing is None
+
+    def apply(self, rule):
+        # Mise à jour incrémentale après l'écriture dans la Sheet : seul le jour concerné est réindexé
+        with self._lock:
+            rules = [r for r in self.by_weekday[rule.weekday] if r.row != rule.row] + [rule]
+            rules.sort(key=lambda r: r.row)
+            self.by_weekday[rule.weekday] = rules
+            self.next_row = max(self.next_row, rule.row + 1)
+            self._reserved.pop(rule.weekday, None)
+            self._reindex(rule.weekday)
+
+
+def to_epoch_minutes(dt):
+    return int((dt - EPOCH).total_seconds()) // 60
+
+
+def from_epoch_minutes(minutes):
+    return (EPOCH + datetime.timedelta(minutes=minutes)).astimezone(timezone)
+
+
+def _local_epoch_minutes(day, minutes):
+    # Heure locale de Paris -> minutes epoch UTC (pytz applique le bon décalage été / hiver) ;
+    # None si l'heure n'existe pas (passage à l'heure d'été), heure d'hiver si elle existe deux fois
+    local = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=minutes)
+    try:
+        return to_epoch_minutes(timezone.localize(local, is_dst=None))
+    except pytz.NonExistentTimeError:
+        return None
+    except pytz.AmbiguousTimeError:
+        return to_epoch_minutes(timezone.localize(local, is_dst=False))
+
+
+# -- Expansion
+def expand(rules, weeks=1, start_date=None):
+    # Renvoie deux tableaux triés (débuts, fins) en minutes epoch pour les `weeks` semaines à venir
+    start_date = start_date or datetime.datetime.now(timezone).date()
+    starts = array("q")
+    ends = array("q")
+    for n in range(weeks * 7):
+        day = start_date + datetime.timedelta(days=n)
+        for first, last, duration in rules[day.weekday()]:
+            count = (last - first) // duration
+            if count <= 0:
+                continue
+            base = _local_epoch_minutes(day, first)
+            top = _local_epoch_minutes(day, last)
+            if base is not None and top is not None and top - base == last - first:
+                # Pas de changement d'heure dans la plage : décalage constant
+                starts.extend(range(base, base + count * duration, duration))
+                ends.extend(range(base + duration, base + (count + 1) * duration, duration))
+            else:
+                # Jour de changement d'heure : un créneau dont le début ou la fin n'existe pas en heure locale,
+                # ou qui enjambe le changement (durée réelle différente), n'est pas proposé
+                for i in range(count):
+                    start = _local_epoch_minutes(day, first + i * duration)
+                    end = _local_epoch_minutes(day, first + (i + 1) * duration)
+                    if start is None or end is None or end - start != duration:
+                        continue
+                    starts.append(start)
+                    ends.append(end)
+
+    if any(starts[i] > starts[i + 1] for i in range(len(starts) - 1)):
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        starts = array("q", (starts[i] for i in order))
+        ends = array("q", (ends[i] for i in order))
+    return starts, ends
+
+
+def subtract_busy(starts, ends, busy):
+    # Retire en bloc les créneaux qui chevauchent une plage occupée (busy : [(début, fin)] datetimes triés)
+    busy_starts = array("q", (to_epoch_minutes(b[0]) for b in busy))
+    busy_ends = array("q", (-(-int((b[1] - EPOCH).total_seconds()) // 60) for b in busy))
+    free_starts = array("q")
+    free_ends = array("q")
+    for start, end in zip(starts, ends):
+        idx = bisect.bisect_left(busy_starts, end)
+        if idx > 0 and busy_ends[idx - 1] > start:
+            continue
+        free_starts.append(start)
+        free_ends.append(end)
+    return free_starts, free_ends
+
+
+def to_datetimes(starts, ends):
+    return [(from_epoch_minutes(s), from_epoch_minutes(e)) for s, e in zip(starts, ends)]
@@ -0,0 +1,207 @@
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Colonnes de la Sheet des créneaux (A à E)
+COLUMNS = ["Date", "Heure", "Durée", "Disponible"]
+AVAILABLE = "✅"
+BOOKED = "❌"
+
+
+class SlotStore:
+    # Interface commune des backends de créneaux utilisés par /rdv, book_slot et rdv_submit.
+    # Les index de ligne commencent à 0 (ligne 2 de la Sheet, après l'en-tête).
+
+    def rows(self):
+        raise NotImplementedError
+
+    def available_rows(self):
+        # [(index, ligne)] des créneaux marqués disponibles
+        return [(idx, row) for idx, row in enumerate(self.rows()) if row.get("Disponible") == AVAILABLE]
+
+    def mark_booked(self, row_idx):
+        raise NotImplementedError
+
+    def append_booking(self, values):
+        self.append_bookings([values])
+
+    def append_bookings(self, rows):
+        raise NotImplementedError
+
+
+class SheetStore(SlotStore):
+    # Google Sheets comme source de vérité (lecture via le cache, écritures regroupées)
+
+    def __init__(self, get_sheet, cache, writer):
+        self.get_sheet = get_sheet
+        self.cache = cache
+        self.writer = writer
+
+    def rows(self):
+        return self.cache.get_or_load("slots", lambda: self.get_sheet().get_all_records())
+
+    def mark_booked(self, row_idx):
+        row = row_idx + 2  # ligne +2 (en-tête + index 0)
+        self.writer.write(self.get_sheet(), [{"range": f"D{row}", "values": [[BOOKED]]}]).result()
+
+        def patch(rows):
+            rows = list(rows)
+            rows[row_idx] = dict(rows[row_idx], Disponible=BOOKED)
+            return rows
+        self.cache.patch("slots", patch)
+
+    def append_bookings(self, rows):
+        # Un seul appel values:append pour toutes les lignes
+        self.get_sheet().append_rows([list(values) for values in rows])
+        self.cache.invalidate("slots")
+
+
+class SqliteStore(SlotStore):
+    # SQLite (WAL) comme chemin rapide ; chaque modification est aussi placée dans une file
+    # d'envoi persistante, répliquée vers la Sheet par SheetReplicator
+
+    def __init__(self, path, get_sheet):
+        self.path = path
+        self.get_sheet = get_sheet
+        self._local = threading.local()
+        self._seeded = threading.Event()
+
+    def _create_schema(self, conn):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS slots (
+                row_idx INTEGER PRIMARY KEY,
+                date TEXT, heure TEXT, duree TEXT, disponible TEXT, extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS slots_available ON slots (disponible, date, heure);
+            CREATE TABLE IF NOT EXISTS sheet_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                range TEXT NOT NULL,
+                vals TEXT NOT NULL
+            );
+        """)
+
+    def _ensure_seeded(self):
+        # Premier démarrage : la base est remplie depuis la Sheet au premier accès, pas à l'import
+        if self._seeded.is_set():
+            return
+        if self._conn().execute("SELECT COUNT(*) FROM slots").fetchone()[0] == 0:
+            self.import_from_sheet()
+        self._seeded.set()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def import_from_sheet(self):
+        # Remplace le contenu local par celui de la Sheet (premier démarrage ou resynchronisation manuelle)
+        values = self.get_sheet().get_all_values()[1:]
+        rows = [(idx, *(list(row) + [""] * 5)[:5]) for idx, row in enumerate(values)]
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots")
+            conn.executemany("INSERT INTO slots VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._seeded.set()
+        logger.info("Store SQLite initialisé depuis la Sheet : %d lignes", len(rows))
+
+    def rows(self):
+        self._ensure_seeded()
+        cursor = self._conn().execute("SELECT date, heure, duree, disponible FROM slots ORDER BY row_idx")
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def available_rows(self):
+        self._ensure_seeded()
+        cursor = self._conn().execute(
+            "SELECT row_idx, date, heure, duree FROM slots WHERE disponible = ? ORDER BY date, heure", (AVAILABLE,))
+        return [(row[0], dict(zip(COLUMNS, row[1:]), Disponible=AVAILABLE)) for row in cursor]
+
+    def _write(self, conn, range_, values):
+        conn.execute("INSERT INTO sheet_outbox (range, vals) VALUES (?, ?)", (range_, json.dumps(values)))
+
+    def mark_booked(self, row_idx):
+        self._ensure_seeded()
+        with self._transaction() as conn:
+            conn.execute("UPDATE slots SET disponible = ? WHERE row_idx = ?", (BOOKED, row_idx))
+            self._write(conn, f"D{row_idx + 2}", [[BOOKED]])
+
+    def append_bookings(self, rows):
+        # Lignes ajoutées à la suite : la même plage est écrite dans la Sheet (pas d'append_row)
+        rows = [(list(values) + [""] * 5)[:5] for values in rows]
+        if not rows:
+            return
+        self._ensure_seeded()
+        with self._transaction() as conn:
+            first_idx = conn.execute("SELECT COALESCE(MAX(row_idx) + 1, 0) FROM slots").fetchone()[0]
+            conn.executemany("INSERT INTO slots VALUES (?, ?, ?, ?, ?, ?)",
+                             [(first_idx + n, *values) for n, values in enumerate(rows)])
+            first, last = first_idx + 2, first_idx + 1 + len(rows)
+            self._write(conn, f"A{first}:E{last}", rows)
+
+    def pending_changes(self, limit=500):
+        cursor = self._conn().execute("SELECT id, range, vals FROM sheet_outbox ORDER BY id LIMIT ?", (limit,))
+        return [(id_, range_, json.loads(vals)) for id_, range_, vals in cursor]
+
+    def ack_changes(self, last_id):
+        self._conn().execute("DELETE FROM sheet_outbox WHERE id <= ?", (last_id,))
+
+
+class SheetReplicator:
+    # Pousse périodiquement les modifications en attente vers la Sheet, en un seul batchUpdate par lot
+
+    def __init__(self, store, writer, interval=5, active=None):
+        self.store = store
+        self.writer = writer
+        self.interval = interval
+        self.active = active  # Plusieurs workers sur la même base : seul le leader réplique
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def flush(self):
+        sent = 0
+        while True:
+            changes = self.store.pending_changes()
+            if not changes:
+                return sent
+            data = [{"range": range_, "values": values} for _, range_, values in changes]
+            self.writer.write(self.store.get_sheet(), data).result()
+            self.store.ack_changes(changes[-1][0])
+            sent += len(changes)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self.active and not self.active():
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de la réplication vers la Sheet")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheet-replicator", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,169 @@
+import datetime
+import heapq
+import json
+import threading
+import time
+
+from freebusy import query_busy, merge_intervals, to_aware
+
+# Consultants et équipes d'un même déploiement. Exemple de fichier TEAMS_CONFIG :
+# {
+#   "resources": {
+#     "alice": {"calendar": "alice@exemple.fr", "slack_id": "U123", "hours": ["09:00", "18:00"], "days": [0, 1, 2, 3]},
+#     "bob": {"calendar": "bob@exemple.fr"}
+#   },
+#   "teams": {"conseil": ["alice", "bob"]}
+# }
+
+DEFAULT_HOURS = ("09:00", "18:00")
+DEFAULT_DAYS = (0, 1, 2, 3, 4)  # Lundi → vendredi
+SLOT_STEP = datetime.timedelta(minutes=15)  # Les créneaux proposés commencent sur un quart d'heure
+
+
+class Resource:
+    __slots__ = ("name", "calendar", "slack_id", "start", "end", "days")
+
+    def __init__(self, name, calendar, slack_id=None, hours=DEFAULT_HOURS, days=DEFAULT_DAYS):
+        self.name = name
+        self.calendar = calendar
+        self.slack_id = slack_id
+        self.start = datetime.time.fromisoformat(hours[0])
+        self.end = datetime.time.fromisoformat(hours[1])
+        self.days = frozenset(days)
+
+    def off_hours(self, time_min, time_max):
+        # Heures non travaillées sur la fenêtre, sous forme d'intervalles "occupés" (heure de Paris)
+        off = []
+        day = to_aware(time_min).date() - datetime.timedelta(days=1)
+        last = to_aware(time_max).date()
+        cursor = to_aware(datetime.datetime.combine(day, datetime.time()))
+        while day <= last:
+            if day.weekday() in self.days:
+                opens = to_aware(datetime.datetime.combine(day, self.start))
+                off.append((cursor, opens))
+                cursor = to_aware(datetime.datetime.combine(day, self.end))
+            day += datetime.timedelta(days=1)
+        off.append((cursor, to_aware(datetime.datetime.combine(day, datetime.time()))))
+        return [(start, end) for start, end in off if start < end]
+
+
+class Directory:
+    def __init__(self, resources, teams=None):
+        self.resources = resources
+        self.teams = teams or {}
+        self._by_slack_id = {r.slack_id: r for r in resources.values() if r.slack_id}
+
+    @classmethod
+    def load(cls, path, default_calendar):
+        # Sans fichier de configuration : une seule ressource, l'agenda CALENDAR_ID
+        if not path:
+            return cls({"default": Resource("default", default_calendar)})
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        resources = {}
+        for name, item in config.get("resources", {}).items():
+            resources[name] = Resource(name, item["calendar"], item.get("slack_id"),
+                                       item.get("hours", DEFAULT_HOURS), item.get("days", DEFAULT_DAYS))
+        for team, members in config.get("teams", {}).items():
+            unknown = [m for m in members if m not in resources]
+            if unknown:
+                raise ValueError(f"Équipe {team} : membres inconnus {', '.join(unknown)}")
+        return cls(resources, config.get("teams"))
+
+    def for_slack_user(self, slack_id):
+        return self._by_slack_id.get(slack_id)
+
+    def resolve(self, names):
+        # Noms de consultants et/ou d'équipes → ressources, sans doublon, dans l'ordre
+        resolved = {}
+        for name in names:
+            if name in self.teams:
+                for member in self.teams[name]:
+                    resolved[member] = self.resources[member]
+            elif name in self.resources:
+                resolved[name] = self.resources[name]
+            else:
+                raise KeyError(name)
+        return list(resolved.values())
+
+
+class AvailabilityIndex:
+    # Plages occupées indexées par (agenda, temps) : une liste triée et fusionnée par agenda,
+    # rechargée par lots freebusy (50 agendas par appel) quand elle est trop ancienne ou trop courte.
+    # La fenêtre chargée va jusqu'à la fin du jour de time_max plus `margin` : une requête répétée
+    # ("maintenant" + horizon, qui avance à chaque appel) reste couverte pendant le TTL.
+
+    def __init__(self, ttl=60, margin=datetime.timedelta(days=1)):
+        self.ttl = ttl
+        self.margin = margin
+        self._busy = {}  # calendar_id -> (chargé_à, time_min, time_max, intervalles)
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def _lookup(self, calendar_ids, time_min, time_max, result):
+        # Entrées valides copiées dans `result` ; renvoie les agendas à recharger
+        now = time.monotonic()
+        missing = []
+        with self._lock:
+            for calendar_id in calendar_ids:
+                entry = self._busy.get(calendar_id)
+                if entry is None or now - entry[0] > self.ttl or entry[1] > time_min or entry[2] < time_max:
+                    missing.append(calendar_id)
+                else:
+                    result[calendar_id] = entry[3]
+        return missing
+
+    def busy(self, service, calendar_ids, time_min, time_max):
+        time_min, time_max = to_aware(time_min), to_aware(time_max)
+        result = {}
+        missing = self._lookup(calendar_ids, time_min, time_max, result)
+        if not missing:
+            return result
+        # Un seul chargement à la fois : les appels arrivés pendant une requête freebusy relisent son résultat
+        with self._loading:
+            missing = self._lookup(missing, time_min, time_max, result)
+            if missing:
+                now = time.monotonic()
+                fetch_max = _ceil(time_max, datetime.timedelta(days=1)) + self.margin
+                fetched = query_busy(service, missing, time_min, fetch_max)
+                with self._lock:
+                    for calendar_id, intervals in fetched.items():
+                        self._busy[calendar_id] = (now, time_min, fetch_max, intervals)
+                # Résultat construit à partir de la réponse : un invalidate() concurrent ne fait pas perdre l'entrée
+                for calendar_id in missing:
+                    result[calendar_id] = fetched.get(calendar_id, [])
+        return result
+
+    def invalidate(self, calendar_id=None):
+        with self._lock:
+            if calendar_id is None:
+                self._busy.clear()
+            else:
+                self._busy.pop(calendar_id, None)
+
+
+def _ceil(dt, step):
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + -((midnight - dt) // step) * step
+
+
+def first_common_free(busy_lists, duration, time_min, time_max):
+    # Fusion k-voies des listes occupées (déjà triées) : le premier trou assez long est libre pour tous
+    cursor = _ceil(to_aware(time_min), SLOT_STEP)
+    time_max = to_aware(time_max)
+    for start, end in heapq.merge(*busy_lists):
+        if start - cursor >= duration:
+            break
+        if end > cursor:
+            cursor = _ceil(end, SLOT_STEP)
+        if cursor >= time_max:
+            return None
+    if cursor + duration > time_max:
+        return None
+    return cursor, cursor + duration
+
+
+def common_free_slot(index, service, resources, duration, time_min, time_max):
+    busy = index.busy(service, [r.calendar for r in resources], time_min, time_max)
+    busy_lists = [merge_intervals(busy[r.calendar] + r.off_hours(time_min, time_max)) for r in resources]
+    return first_common_free(busy_lists, duration, time_min, time_max)